@@ -0,0 +1,282 @@
+# analysis.py
+"""
+SCI KPI Analysis Module
+Pure aggregation functions behind the dashboard views. Nothing in here
+touches Streamlit, so the same logic serves the interactive dashboard and
+the headless report generator (python -m sci_dashboard report ...).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# ==============================================
+# CONSTANTS
+# ==============================================
+
+# KPI columns
+KPI_COLS = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
+
+# Month names and ordering
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+MONTH_ORDER = {month: idx for idx, month in enumerate(MONTHS, start=1)}
+
+# Quarter mapping
+QUARTER_MAP = {
+    "January": "Q1", "February": "Q1", "March": "Q1",
+    "April": "Q2", "May": "Q2", "June": "Q2",
+    "July": "Q3", "August": "Q3", "September": "Q3",
+    "October": "Q4", "November": "Q4", "December": "Q4"
+}
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+
+VIEWS = ["yearly", "monthly", "quarterly", "sector", "vessel"]
+
+# Period-over-period comparisons per view: label -> lag in that view's periods
+COMPARISONS = {
+    "yearly": {"YoY": 1},
+    "quarterly": {"QoQ": 1, "YoY": 4},
+    "monthly": {"MoM": 1, "YoY": 12},
+}
+REPORT_FORMATS = ["csv", "parquet", "html"]
+
+# ==============================================
+# BASE AGGREGATE
+# ==============================================
+
+def add_period_columns(df):
+    """Add month_index, month_year ('Apr 2023') and quarter derived from year/month"""
+    df["month_index"] = df["month"].map(MONTH_ORDER)
+    df["month_year"] = df["month"].str[:3] + " " + df["year"].astype(str)
+    df["quarter"] = df["month"].map(QUARTER_MAP)
+    return df
+
+def build_monthly_base(df):
+    """
+    Aggregate detail rows to one row per year, month, sector and vessel.
+
+    This is the only pass over the detail data; every view below is
+    derived from the (much smaller) result.
+    """
+    base = df.groupby(['year', 'month', 'sector', 'vessel'])[KPI_COLS].sum().reset_index()
+    return add_period_columns(base)
+
+def build_dimension_catalog(base):
+    """
+    Distinct filter values for the dashboard widgets, computed once per
+    data version from the base aggregate.
+
+    Returns:
+        dict: years, sectors, vessels (sorted lists), sector_vessels
+            (lookup dict of sorted lists) and months_by_year
+            (calendar-ordered months that have data in each year)
+    """
+    pairs = base[['sector', 'vessel']].drop_duplicates()
+    sector_vessels = {str(k): sorted(map(str, g)) for k, g in pairs.groupby('sector')['vessel']}
+
+    periods = base[['year', 'month_index']].drop_duplicates()
+    months_by_year = {
+        int(year): [MONTHS[idx - 1] for idx in sorted(g)]
+        for year, g in periods.groupby('year')['month_index']
+    }
+
+    return {
+        "years": sorted(months_by_year),
+        "sectors": sorted(sector_vessels),
+        "vessels": sorted(map(str, pairs['vessel'].unique())),
+        "sector_vessels": sector_vessels,
+        "months_by_year": months_by_year,
+    }
+
+def months_between(from_month, to_month):
+    """Calendar months from from_month to to_month inclusive"""
+    from_idx = MONTH_ORDER[from_month]
+    to_idx = MONTH_ORDER[to_month]
+    return [m for m in MONTHS if from_idx <= MONTH_ORDER[m] <= to_idx]
+
+def filter_data(df, year_range, month_range, sector, vessel):
+    """Apply common filters to dataframe"""
+    # Year filter
+    filtered = df[(df['year'] >= year_range[0]) & (df['year'] <= year_range[1])]
+
+    # Month filter (apply only if 'month' column is present)
+    if 'month' in df.columns:
+        filtered = filtered[filtered['month'].isin(months_between(*month_range))]
+
+    # Sector filter
+    if sector != "All":
+        filtered = filtered[filtered['sector'] == sector]
+
+    # Vessel filter
+    if vessel != "All":
+        filtered = filtered[filtered['vessel'] == vessel]
+
+    return filtered
+
+# ==============================================
+# VIEWS
+# ==============================================
+
+def yearly_view(base, year_range, sector="All", vessel="All"):
+    """KPI sums per year, sector and vessel"""
+    grouped_df = base.groupby(['year', 'sector', 'vessel'])[KPI_COLS].sum().reset_index()
+    return filter_data(grouped_df, year_range, ("January", "December"), sector, vessel)
+
+def monthly_view(base, year_range, month_range=("January", "December"), sector="All", vessel="All"):
+    """KPI sums per month, sector and vessel"""
+    columns = ['year', 'month', 'sector', 'vessel'] + KPI_COLS + ['month_index', 'month_year']
+    return filter_data(base, year_range, month_range, sector, vessel)[columns]
+
+def quarterly_view(base, year_range, quarters=QUARTERS, sector="All", vessel="All"):
+    """KPI sums per quarter, sector and vessel"""
+    grouped_df = base.groupby(["year", "quarter", "sector", "vessel"])[KPI_COLS].sum().reset_index()
+    grouped_df["quarter_year"] = grouped_df["quarter"] + " " + grouped_df["year"].astype(str)
+    filtered_df = grouped_df[grouped_df["quarter"].isin(quarters)]
+    return filter_data(filtered_df, year_range, ("January", "December"), sector, vessel)
+
+def sector_view(base, year_range, month_range=("January", "December"), sectors=None):
+    """KPI sums per sector and month"""
+    grouped_df = base.groupby(['year', 'sector', 'month'])[KPI_COLS].sum().reset_index()
+    filtered_df = filter_data(grouped_df, year_range, month_range, "All", "All")
+    if sectors is not None:
+        filtered_df = filtered_df[filtered_df["sector"].isin(sectors)]
+    return filtered_df
+
+def vessel_view(base, year_range, month_range=("January", "December"), vessels=None):
+    """KPI sums per vessel and month"""
+    grouped_df = base.groupby(['year', 'vessel', 'month'])[KPI_COLS].sum().reset_index()
+    filtered_df = filter_data(grouped_df, year_range, month_range, "All", "All")
+    if vessels is not None:
+        filtered_df = filtered_df[filtered_df["vessel"].isin(vessels)]
+    return filtered_df
+
+VIEW_FUNCTIONS = {
+    "yearly": yearly_view,
+    "monthly": monthly_view,
+    "quarterly": quarterly_view,
+    "sector": sector_view,
+    "vessel": vessel_view,
+}
+
+# ==============================================
+# PERIOD-OVER-PERIOD COMPARISONS
+# ==============================================
+
+# Columns that identify a period in each comparable view
+PERIOD_COLS = {
+    "yearly": ["year"],
+    "quarterly": ["year", "quarter"],
+    "monthly": ["year", "month", "month_index", "month_year"],
+}
+
+def period_ordinal(df, view):
+    """
+    Consecutive integer per period, so a lag of n periods is a plain offset.
+    `year` is the fiscal year (April-March), so months and quarters are
+    counted from April: April is fiscal month 0 and Q2 (Apr-Jun) fiscal
+    quarter 0, while January-March and Q1 close the fiscal year.
+    """
+    if view == "yearly":
+        return df["year"]
+    if view == "quarterly":
+        return df["year"] * 4 + (df["quarter"].str[1].astype(int) - 2) % 4
+    return df["year"] * 12 + (df["month_index"] - 4) % 12
+
+def period_comparison(base, view, lag, keys=("sector", "vessel")):
+    """
+    Delta and percentage change of every KPI against the period `lag`
+    periods earlier, for all key groups at once.
+
+    The prior values come from re-indexing the same aggregate with its
+    period shifted by `lag`, so gaps in a vessel's history yield NaN
+    rather than comparing against the wrong period.
+
+    Args:
+        base: Monthly base aggregate (see build_monthly_base)
+        view: "yearly", "quarterly" or "monthly"
+        lag: Number of periods to look back (see COMPARISONS)
+        keys: Grouping columns; () compares totals across the selection
+
+    Returns:
+        pd.DataFrame: keys, period columns, and for each KPI the current
+            value, <KPI>_prior, <KPI>_delta and <KPI>_pct
+    """
+    keys = list(keys)
+    agg = base.groupby(keys + PERIOD_COLS[view])[KPI_COLS].sum().reset_index()
+    agg["period"] = period_ordinal(agg, view)
+    index_cols = keys + ["period"]
+
+    current = agg.set_index(index_cols)
+    prior = (
+        agg.assign(period=agg["period"] + lag)
+        .set_index(index_cols)[KPI_COLS]
+        .reindex(current.index)
+    )
+    delta = current[KPI_COLS] - prior
+    pct = (delta / prior.abs() * 100).replace([np.inf, -np.inf], np.nan)
+
+    columns = {}
+    for col in KPI_COLS:
+        columns[col] = current[col]
+        columns[f"{col}_prior"] = prior[col]
+        columns[f"{col}_delta"] = delta[col]
+        columns[f"{col}_pct"] = pct[col].round(2)
+
+    result = pd.concat([current[PERIOD_COLS[view]], pd.DataFrame(columns)], axis=1)
+    result = result.sort_index(level=index_cols[::-1]).reset_index()
+    if view == "quarterly":
+        result["quarter_year"] = result["quarter"] + " " + result["year"].astype(str)
+    return result.drop(columns=["period"])
+
+def comparison_view(base, view, lag, year_range, month_range=("January", "December"),
+                    quarters=QUARTERS, sector="All", vessel="All", keys=("sector", "vessel")):
+    """period_comparison restricted to the dashboard's filter selection"""
+    # Scope by sector/vessel first; periods are filtered afterwards so the
+    # first selected period still has its prior value
+    scoped = filter_data(base, (base["year"].min(), base["year"].max()),
+                         ("January", "December"), sector, vessel)
+    compared = period_comparison(scoped, view, lag, keys)
+    compared = filter_data(compared, year_range, month_range, "All", "All")
+    if view == "quarterly":
+        compared = compared[compared["quarter"].isin(quarters)]
+    return compared
+
+# ==============================================
+# BATCH REPORTS
+# ==============================================
+
+def build_report(base, year_range, views=VIEWS):
+    """Compute the requested views over a year range from one base aggregate"""
+    return {view: VIEW_FUNCTIONS[view](base, year_range) for view in views}
+
+def write_report(report, output_dir, fmt, year_range):
+    """
+    Write each view of a report to output_dir.
+
+    Args:
+        report: Mapping of view name to dataframe (see build_report)
+        output_dir: Directory to write into (created if missing)
+        fmt: One of REPORT_FORMATS
+        year_range: (from_year, to_year) used in the file names
+
+    Returns:
+        list: Paths of the files written
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unsupported report format: {fmt}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for view, df in report.items():
+        path = os.path.join(output_dir, f"{view}_{year_range[0]}_{year_range[1]}.{fmt}")
+        if fmt == "csv":
+            df.to_csv(path, index=False)
+        elif fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_html(path, index=False, float_format=lambda val: f"{val:,.2f}")
+        paths.append(path)
+    return paths
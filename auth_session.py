@@ -0,0 +1,323 @@
+# auth_session.py
+"""
+SCI Login Session Module
+Token-based login sessions for login_page.py. No Streamlit imports.
+
+After a password login the Firebase ID and refresh tokens are kept in a
+server-side SessionStore under an opaque session id. Reruns and repeat
+visits verify the ID token locally against Google's cached public
+certificates; tokens are refreshed and the approval status re-checked in
+a background thread before they run out, so the network stays off the
+critical path.
+
+Each session is bound to a fingerprint of the client that created it
+(its User-Agent), so a copied session id does not work from another
+browser. Sessions live in this process's memory: with several workers
+behind a load balancer, the balancer must keep each browser on one
+worker (sticky sessions), or a refresh on another worker asks for the
+password again.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.auth import jwt
+
+logger = logging.getLogger(__name__)
+
+# Certificates Firebase ID tokens are signed with
+GOOGLE_CERTS_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+
+# Used when the certificate response carries no Cache-Control max-age
+DEFAULT_KEY_TTL = 3600
+
+# Minimum gap between refetches triggered by an unknown key id
+MIN_KEY_REFETCH = 60
+
+# Tolerated clock difference with Google when checking iat/exp
+CLOCK_SKEW = 60
+
+# Refresh tokens this many seconds before the ID token expires (tokens last 1 h)
+REFRESH_MARGIN = int(os.getenv("AUTH_REFRESH_MARGIN", "600"))
+
+# Re-check the approved_users entry at most this often per session
+APPROVAL_TTL = int(os.getenv("AUTH_APPROVAL_TTL", "900"))
+
+# Sessions unused for this long are dropped and need a password login
+SESSION_IDLE_TTL = int(os.getenv("AUTH_SESSION_IDLE_TTL", str(2 * 3600)))
+
+# Sessions older than this need a password login however active they are
+SESSION_MAX_AGE = int(os.getenv("AUTH_SESSION_MAX_AGE", str(12 * 3600)))
+
+
+class TokenError(Exception):
+    """ID token failed verification"""
+
+
+class TokenExpired(TokenError):
+    """ID token is past its expiry time"""
+
+# ==============================================
+# PUBLIC KEYS
+# ==============================================
+
+def fetch_google_certs(url=GOOGLE_CERTS_URL, timeout=10):
+    """
+    Download Google's token-signing certificates.
+
+    Returns:
+        tuple: (certs, max_age) - mapping of key id to PEM certificate, and
+            seconds the response may be cached for
+    """
+    import requests
+
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    return response.json(), int(match.group(1)) if match else DEFAULT_KEY_TTL
+
+
+class PublicKeyCache:
+    """
+    Certificates cached for as long as Google's Cache-Control allows.
+    If a refetch fails, the cached certificates keep being served and the
+    fetch is retried after MIN_KEY_REFETCH seconds.
+    fetch is injectable so tests can stand in for the key endpoint.
+    """
+
+    def __init__(self, fetch=fetch_google_certs, clock=time.time):
+        self._fetch = fetch
+        self._clock = clock
+        self._certs = {}
+        self._expires_at = 0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def certs(self, kid=None):
+        """Current certificates; refetched when stale or when kid is unknown (key rotation)"""
+        with self._lock:
+            now = self._clock()
+            stale = now >= self._expires_at
+            rotated = (
+                kid is not None and kid not in self._certs
+                and (self._fetched_at is None or now - self._fetched_at >= MIN_KEY_REFETCH)
+            )
+            if stale or rotated:
+                self._fetched_at = now
+                try:
+                    certs, max_age = self._fetch()
+                except Exception as e:
+                    if not self._certs:
+                        raise
+                    logger.warning(f"Token key refetch failed, using cached keys: {e}")
+                    self._expires_at = max(self._expires_at, now + MIN_KEY_REFETCH)
+                    return self._certs
+                self._certs = dict(certs)
+                self._expires_at = now + max_age
+            return self._certs
+
+# ==============================================
+# TOKEN VERIFICATION
+# ==============================================
+
+def verify_id_token(id_token, key_cache, project_id, clock=time.time):
+    """
+    Verify a Firebase ID token offline.
+
+    Checks the RS256 signature against the cached certificates, plus
+    expiry, audience, issuer and subject.
+
+    Returns:
+        dict: Token claims
+
+    Raises:
+        TokenExpired: The token has expired (refresh it)
+        TokenError: The token is malformed, forged or for another project
+    """
+    try:
+        header = jwt.decode_header(id_token)
+        claims = jwt.decode(id_token, verify=False)
+    except (ValueError, TypeError) as e:
+        raise TokenError(f"Malformed ID token: {e}") from e
+
+    if header.get("alg") != "RS256":
+        raise TokenError(f"Unexpected token algorithm: {header.get('alg')}")
+    if claims.get("exp", 0) <= clock():
+        raise TokenExpired("ID token has expired")
+
+    certs = key_cache.certs(header.get("kid"))
+    if header.get("kid") not in certs:
+        raise TokenError("ID token signed with an unknown key")
+    try:
+        claims = jwt.decode(id_token, certs=certs, audience=project_id,
+                            clock_skew_in_seconds=CLOCK_SKEW)
+    except ValueError as e:
+        raise TokenError(f"ID token rejected: {e}") from e
+
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise TokenError("ID token has the wrong issuer")
+    if not claims.get("sub"):
+        raise TokenError("ID token has no subject")
+    return claims
+
+# ==============================================
+# SESSIONS
+# ==============================================
+
+def client_fingerprint(client):
+    """Hash of the client identity (e.g. User-Agent) a session is bound to"""
+    return hashlib.sha256((client or "").encode()).hexdigest()
+
+class SessionStore:
+    """
+    Server-side login sessions keyed by an opaque session id.
+
+    Args:
+        key_cache: PublicKeyCache used to verify ID tokens
+        project_id: Firebase project the tokens must be issued for
+        refresh_tokens: Callable(refresh_token) -> dict with idToken and
+            refreshToken (pyrebase's auth.refresh)
+        check_approval: Callable(email) -> bool (the approved_users lookup)
+    """
+
+    def __init__(self, key_cache, project_id, refresh_tokens, check_approval, clock=time.time):
+        self.key_cache = key_cache
+        self.project_id = project_id
+        self._refresh_tokens = refresh_tokens
+        self._check_approval = check_approval
+        self._clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="token-refresh")
+
+    def create(self, user, approved, client=None):
+        """
+        Start a session from a pyrebase sign-in result, bound to client
+        (see client_fingerprint).
+
+        Returns:
+            str: Session id, or None if the user is not approved
+        """
+        if not approved:
+            return None
+        claims = verify_id_token(user["idToken"], self.key_cache, self.project_id, self._clock)
+        now = self._clock()
+        sid = secrets.token_urlsafe(32)
+        with self._lock:
+            self._prune(now)
+            self._sessions[sid] = {
+                "email": claims.get("email", user.get("email", "")),
+                "uid": claims["sub"],
+                "client": client_fingerprint(client),
+                "created": now,
+                "id_token": user["idToken"],
+                "refresh_token": user["refreshToken"],
+                "expires_at": claims["exp"],
+                "approved_at": now,
+                "last_seen": now,
+                "refreshing": None,
+            }
+        return sid
+
+    def resume(self, sid, client=None):
+        """
+        Email of the session's user if its token is valid, the user is
+        still approved and client matches the one that logged in, else
+        None. Uses only local checks unless the token has already expired;
+        refreshes due soon run in the background.
+        """
+        with self._lock:
+            record = self._sessions.get(sid) if sid else None
+        if record is None:
+            return None
+        if not hmac.compare_digest(record["client"], client_fingerprint(client)):
+            # Do not revoke: the rightful browser may still be using it
+            logger.warning(f"Session for {record['email']} presented by a different client")
+            return None
+
+        now = self._clock()
+        if self._expired(record, now):
+            self.revoke(sid)
+            return None
+
+        try:
+            verify_id_token(record["id_token"], self.key_cache, self.project_id, self._clock)
+        except TokenExpired:
+            # Idle past expiry: nothing to serve until a refresh succeeds
+            if not self._refresh(sid):
+                return None
+        except TokenError as e:
+            logger.warning(f"Dropping session with invalid token: {e}")
+            self.revoke(sid)
+            return None
+
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is None:
+                return None
+            record["last_seen"] = now
+            due = (record["expires_at"] - now <= REFRESH_MARGIN
+                   or now - record["approved_at"] >= APPROVAL_TTL)
+            if due and record["refreshing"] is None:
+                record["refreshing"] = self._executor.submit(self._refresh, sid)
+            return record["email"]
+
+    def revoke(self, sid):
+        """Forget a session (logout)"""
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def _refresh(self, sid):
+        """
+        Exchange the refresh token and re-check approval. The session is
+        dropped if approval was withdrawn, or if the refresh failed and the
+        current token has expired; otherwise a failed refresh is retried
+        on a later rerun.
+        """
+        with self._lock:
+            record = self._sessions.get(sid)
+        if record is None:
+            return False
+        try:
+            tokens = self._refresh_tokens(record["refresh_token"])
+            claims = verify_id_token(tokens["idToken"], self.key_cache, self.project_id, self._clock)
+            approved = self._check_approval(record["email"])
+        except Exception as e:
+            logger.warning(f"Session refresh failed for {record['email']}: {e}")
+            with self._lock:
+                record["refreshing"] = None
+                if record["expires_at"] <= self._clock():
+                    self._sessions.pop(sid, None)
+                    return False
+            return True
+
+        with self._lock:
+            if not approved:
+                logger.info(f"Ending session for {record['email']}: no longer approved")
+                self._sessions.pop(sid, None)
+                return False
+            record.update(
+                id_token=tokens["idToken"],
+                refresh_token=tokens["refreshToken"],
+                expires_at=claims["exp"],
+                approved_at=self._clock(),
+                refreshing=None,
+            )
+        return True
+
+    @staticmethod
+    def _expired(record, now):
+        return now - record["last_seen"] > SESSION_IDLE_TTL or now - record["created"] > SESSION_MAX_AGE
+
+    def _prune(self, now):
+        # Caller holds the lock
+        for sid in [s for s, r in self._sessions.items() if self._expired(r, now)]:
+            del self._sessions[sid]
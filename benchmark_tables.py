@@ -0,0 +1,63 @@
+# benchmark_tables.py
+"""
+Table Rendering Benchmark
+Compares the cost of preparing a KPI table for st.dataframe through pandas
+Styler against the plain Arrow path used above STYLER_MAX_ROWS.
+
+Usage:
+    python benchmark_tables.py
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+KPI_COLS = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
+ROW_COUNTS = [100, 500, 1_000, 5_000, 20_000, 50_000]
+
+
+def make_frame(rows):
+    """Build a synthetic KPI frame shaped like the dashboard previews"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "year": rng.integers(2018, 2025, rows),
+        "sector": rng.choice(["COASTAL", "CRUDE", "LINER", "PRODUCT"], rows),
+        "vessel": rng.choice([f"VESSEL {i}" for i in range(80)], rows),
+    })
+    for col in KPI_COLS:
+        df[col] = rng.normal(0, 1_000, rows).round(2)
+    return df
+
+
+def time_call(func, repeat=3):
+    """Return the best wall-clock time of func over a few runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def styler_path(df):
+    """Per-cell formatting as done by df.style.format(...)"""
+    return df.style.format({col: "₹{:,.2f}" for col in KPI_COLS}).to_html()
+
+
+def arrow_path(df):
+    """Serialisation done by st.dataframe for a plain frame"""
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+if __name__ == "__main__":
+    print(f"{'rows':>8} {'styler (s)':>12} {'arrow (s)':>12} {'speedup':>9}")
+    for rows in ROW_COUNTS:
+        df = make_frame(rows)
+        styler_time = time_call(lambda: styler_path(df))
+        arrow_time = time_call(lambda: arrow_path(df))
+        print(f"{rows:>8} {styler_time:>12.4f} {arrow_time:>12.4f} {styler_time / arrow_time:>8.1f}x")
@@ -0,0 +1,277 @@
+# cache_manager.py
+"""
+SCI KPI Cache Manager Module
+One in-process cache for the dashboard's datasets, aggregates, figures and
+downloads, held under a single byte budget. No Streamlit imports.
+
+Entries carry a category whose priority decides eviction order: when the
+budget is exceeded, the lowest-priority entries go first (LRU or LFU
+within a priority), so the monthly base every view is built from is the
+last thing to be dropped. Entries belonging to another data version are
+discarded as soon as a new version is seen; versions ranked older by
+version_order are ignored, so the current version never moves backwards.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Eviction priority per category: higher survives longer
+CATEGORY_PRIORITY = {
+    "base": 3,        # monthly base aggregate behind every view
+    "dataset": 2,     # detail frames (fallback when the summary is unusable)
+    "aggregate": 1,   # filter catalog and per-selection view results
+    "figure": 0,
+    "export": 0,
+    "drill_down": 0,
+}
+
+EVICTION_POLICIES = ["lru", "lfu"]
+
+# ==============================================
+# SIZE ESTIMATION
+# ==============================================
+
+def estimate_size(obj):
+    """Approximate bytes held by a cached object"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(item) for item in obj)
+    if hasattr(obj, "to_plotly_json"):
+        # Plotly figure: dominated by its trace data
+        return estimate_size(obj.to_plotly_json())
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+# ==============================================
+# CACHE
+# ==============================================
+
+class CacheManager:
+    """
+    Byte-budgeted cache shared by every session of the process.
+
+    Args:
+        budget_bytes: Total estimated size the cache may hold
+        policy: "lru" (least recently used first) or "lfu" (fewest hits first)
+        log_interval: Seconds between statistics lines in the log
+        version_order: Callable(version) -> the part of a version that only
+            ever increases (e.g. an ingest counter), or None to treat every
+            version change as current
+    """
+
+    def __init__(self, budget_bytes, policy="lru", log_interval=300, version_order=None):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown cache eviction policy: {policy}")
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.log_interval = log_interval
+        self.version_order = version_order
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._build_locks = {}
+        self._version = None
+        self._last_log = time.monotonic()
+        self._stats = {category: self._empty_stats() for category in CATEGORY_PRIORITY}
+
+    @staticmethod
+    def _empty_stats():
+        return {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+
+    def get_or_build(self, category, key, build, version=None):
+        """
+        Return the value cached under (category, key), calling build() on a
+        miss. Concurrent misses for the same key build only once.
+        """
+        if category not in CATEGORY_PRIORITY:
+            raise ValueError(f"Unknown cache category: {category}")
+        full_key = (category, key)
+        found, value = self._lookup(full_key)
+        if found:
+            return value
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(full_key, threading.Lock())
+        try:
+            with build_lock:
+                # Another session may have built it while we waited
+                found, value = self._lookup(full_key, count=False)
+                if not found:
+                    # A build that raises stores nothing
+                    value = build()
+                    self._store(full_key, value, version)
+        finally:
+            with self._lock:
+                self._build_locks.pop(full_key, None)
+        self._maybe_log()
+        return value
+
+    def _lookup(self, full_key, count=True):
+        with self._lock:
+            entry = self._entries.get(full_key)
+            stats = self._stats[full_key[0]]
+            if entry is None:
+                if count:
+                    stats["misses"] += 1
+                return False, None
+            entry["hits"] += 1
+            entry["last_access"] = time.monotonic()
+            if count:
+                stats["hits"] += 1
+            return True, entry["value"]
+
+    def _store(self, full_key, value, version):
+        size = estimate_size(value)
+        if size > self.budget_bytes:
+            logger.warning(
+                f"Not caching {full_key[0]} entry of {size / 2**20:.1f} MB: "
+                f"larger than the {self.budget_bytes / 2**20:.1f} MB budget"
+            )
+            return
+        with self._lock:
+            if version is not None and version != self._version and not self._newer(version):
+                # Built for a version that is no longer current
+                return
+            now = time.monotonic()
+            self._entries[full_key] = {
+                "value": value,
+                "bytes": size,
+                "version": version,
+                "hits": 0,
+                "created": now,
+                "last_access": now,
+            }
+            self._evict(protect=full_key)
+
+    def _evict(self, protect):
+        # Caller holds the lock
+        used = sum(entry["bytes"] for entry in self._entries.values())
+        if used <= self.budget_bytes:
+            return
+        if self.policy == "lru":
+            rank = lambda item: (CATEGORY_PRIORITY[item[0][0]], item[1]["last_access"])
+        else:
+            rank = lambda item: (CATEGORY_PRIORITY[item[0][0]], item[1]["hits"], item[1]["last_access"])
+
+        evicted = 0
+        freed = 0
+        for full_key, entry in sorted(self._entries.items(), key=rank):
+            if used <= self.budget_bytes:
+                break
+            if full_key == protect:
+                continue
+            del self._entries[full_key]
+            used -= entry["bytes"]
+            freed += entry["bytes"]
+            evicted += 1
+            stats = self._stats[full_key[0]]
+            stats["evictions"] += 1
+            stats["evicted_bytes"] += entry["bytes"]
+        logger.info(f"Cache evicted {evicted} entries ({freed / 2**20:.1f} MB); {self.summary()}")
+
+    def set_version(self, version):
+        """
+        Make version current and drop entries built for any other version.
+        Versions ranked older by version_order are ignored: a session whose
+        probe ran just before another session's upload must not evict the
+        newer entries.
+
+        Returns:
+            bool: True if version became current
+        """
+        with self._lock:
+            if version == self._version or self._older(version):
+                return False
+            self._version = version
+            stale = [k for k, e in self._entries.items() if e["version"] not in (None, version)]
+            for full_key in stale:
+                del self._entries[full_key]
+        if stale:
+            logger.info(f"Cache dropped {len(stale)} entries from older data versions")
+        return True
+
+    def _older(self, version):
+        # Caller holds the lock
+        if self._version is None or self.version_order is None:
+            return False
+        return self.version_order(version) < self.version_order(self._version)
+
+    def _newer(self, version):
+        # Caller holds the lock
+        if self._version is None:
+            return True
+        if self.version_order is None:
+            return False
+        return self.version_order(version) > self.version_order(self._version)
+
+    def clear(self):
+        """Drop every entry (statistics are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    # ==============================================
+    # STATISTICS
+    # ==============================================
+
+    def stats(self):
+        """
+        Per-category statistics.
+
+        Returns:
+            pd.DataFrame: entries, bytes, hits, misses, hit_rate, evictions
+                and evicted_bytes per category, plus a 'total' row
+        """
+        with self._lock:
+            rows = {category: dict(stats, entries=0, bytes=0) for category, stats in self._stats.items()}
+            for (category, _), entry in self._entries.items():
+                rows[category]["entries"] += 1
+                rows[category]["bytes"] += entry["bytes"]
+        df = pd.DataFrame.from_dict(rows, orient="index")
+        df.loc["total"] = df.sum()
+        lookups = df["hits"] + df["misses"]
+        df["hit_rate"] = (df["hits"] / lookups.where(lookups > 0)).round(3)
+        return df[["entries", "bytes", "hits", "misses", "hit_rate", "evictions", "evicted_bytes"]]
+
+    def entries(self):
+        """One row per cached entry, largest first"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [{
+                "category": category,
+                "key": repr(key),
+                "bytes": entry["bytes"],
+                "hits": entry["hits"],
+                "age_s": round(now - entry["created"]),
+                "idle_s": round(now - entry["last_access"]),
+            } for (category, key), entry in self._entries.items()]
+        df = pd.DataFrame(rows, columns=["category", "key", "bytes", "hits", "age_s", "idle_s"])
+        return df.sort_values("bytes", ascending=False, ignore_index=True)
+
+    def summary(self):
+        """One-line statistics for the log"""
+        total = self.stats().loc["total"]
+        hit_rate = "n/a" if pd.isna(total["hit_rate"]) else f"{total['hit_rate']:.1%}"
+        return (
+            f"{int(total['entries'])} entries, {total['bytes'] / 2**20:.1f}/"
+            f"{self.budget_bytes / 2**20:.1f} MB, hit rate {hit_rate}, "
+            f"{int(total['evictions'])} evictions"
+        )
+
+    def _maybe_log(self):
+        now = time.monotonic()
+        if now - self._last_log >= self.log_interval:
+            self._last_log = now
+            logger.info(f"Cache stats: {self.summary()}")
@@ -1,112 +1,248 @@
 import pandas as pd
 import re
 import io
+import csv
+import hashlib
+import json
 import logging
-from typing import Union, Optional
+import os
+import threading
+from datetime import date
+from typing import Union, Optional, Tuple
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_cleaned_data(file: Union[str, io.BytesIO]) -> pd.DataFrame:
-    """
-    Load and clean financial data from CSV file.
-    
-    Args:
-        file: File path (string) or file-like object
-        
-    Returns:
-        pd.DataFrame: Cleaned dataframe ready for database insertion
-    """
-    encoding = 'ISO-8859-1'
+KPI_COLS = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
+REQUIRED_COLS = ['year', 'month', 'sector', 'vessel'] + KPI_COLS
 
-    # Handle different file input types
-    file_obj = None
-    if isinstance(file, str):  # file path
-        file_obj = file
-    else:  # uploaded file-like object
-        try:
-            file_content = file.read()
-            file_obj = io.BytesIO(file_content)
-        except Exception as e:
-            logger.error(f"Error reading file: {e}")
-            raise
+# Fiscal period code -> calendar month name
+FIN_MONTH_MAP = {
+    '001': 'April', '002': 'May', '003': 'June', '004': 'July',
+    '005': 'August', '006': 'September', '007': 'October',
+    '008': 'November', '009': 'December', '010': 'January',
+    '011': 'February', '012': 'March',
+}
+
+ENCODING = 'ISO-8859-1'
 
-    # Step 1: Detect Header Structure
+# Export column name -> database column name
+COLUMN_MAPPING = {
+    "Vessel code": "vessel_code",
+    "Sector Code": "sector",
+    "Vessel": "vessel",
+    "Total Income (In Lacs) Debit/Credit Amount": "Total_Income",
+    "DOE (In Lacs) Debit/Credit Amount": "DOE",
+    "IOE (In Lacs) Debit/Credit Amount": "IOE",
+    "GOP (In Lacs) Debit/Credit Amount": "GOP",
+    "Profit before Int. & Dep. (In Lacs) Debit/Credit Amount": "PBT",
+    "financial_year": "year",
+    "financial_month": "month"
+}
+
+# Export columns never loaded into the database
+COLS_TO_DROP = [
+    "Segment", "Voyage Number",
+    "Depreciation (In Lacs) Debit/Credit Amount",
+    "Profit After Depreciation (In Lacs) Debit/Credit Amount",
+    "Finance Cost (In Lacs) Debit/Credit Amount",
+    "Exchange Gain/Loss (In Lacs) Debit/Credit Amount"
+]
+
+# Columns parsed as plain strings (KPIs are cleaned of separators later)
+TEXT_COLS = ['sector', 'vessel', 'Fiscal year/period'] + KPI_COLS
+
+# Known export layouts, persisted so each is only detected once.
+# Bump PROFILE_SCHEMA when the mapping or spec format above changes.
+FORMAT_PROFILE_PATH = os.getenv("FORMAT_PROFILE_PATH", "format_profiles.json")
+PROFILE_SCHEMA = 1
+_format_profiles = None
+# Uploads from several sessions run on separate threads
+_profiles_lock = threading.Lock()
+
+# Plausible range for the year column
+MIN_YEAR = 2000
+MAX_YEAR_AHEAD = 1
+
+def _read_raw(file: Union[str, io.BytesIO]) -> bytes:
+    """Read a file path or uploaded file-like object into bytes"""
     try:
-        header_preview = pd.read_csv(file_obj, encoding=encoding, nrows=3, header=None)
-        # Only seek if it's a file-like object, not a string path
-        if hasattr(file_obj, 'seek'):
-            file_obj.seek(0)
+        if isinstance(file, str):  # file path
+            with open(file, 'rb') as f:
+                return f.read()
+        return file.read()  # uploaded file-like object
     except Exception as e:
-        logger.error(f"Error reading CSV preview: {e}")
+        logger.error(f"Error reading file: {e}")
         raise
-    
-    row0 = header_preview.iloc[0]
-    row1 = header_preview.iloc[1]
 
-    # Count non-empty, non-unnamed columns in each row
-    row0_named = sum(~row0.isna() & ~row0.astype(str).str.lower().str.startswith('unnamed'))
-    row1_named = sum(~row1.isna() & ~row1.astype(str).str.lower().str.startswith('unnamed'))
+def _sniff_header_rows(raw: bytes) -> Tuple[list, list]:
+    """First two CSV rows, parsed without a pandas pass over the file"""
+    head = raw[:65536].decode(ENCODING)
+    rows = list(zip(range(2), csv.reader(io.StringIO(head))))
+    if len(rows) < 2:
+        raise ValueError("CSV file needs a header row and at least one more row")
+    return rows[0][1], rows[1][1]
+
+def _is_named(value: str) -> bool:
+    return value.strip() != '' and not value.lower().startswith('unnamed')
+
+def _looks_like_data(row: list) -> bool:
+    """True if any cell is a number, so the row is data rather than a header"""
+    for cell in row:
+        try:
+            float(cell.replace(',', '').strip())
+            return True
+        except ValueError:
+            continue
+    return False
+
+def _fingerprint(*rows: list) -> str:
+    """Stable identifier of one or more header rows"""
+    joined = "\x1e".join("\x1f".join(cell.strip() for cell in row) for row in rows)
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()
 
+def _build_profile(header: list, skiprows: int) -> dict:
+    """Precompile the column spec for a layout from its (combined) header"""
+    usecols, names = [], []
+    for idx, name in enumerate(header):
+        if name in COLS_TO_DROP:
+            continue
+        name = COLUMN_MAPPING.get(name, name)
+        if name.strip() == '' or name in names:
+            continue
+        usecols.append(idx)
+        names.append(name)
+    return {
+        'skiprows': skiprows,
+        'usecols': usecols,
+        'names': names,
+        'text_cols': [idx for idx, name in zip(usecols, names) if name in TEXT_COLS],
+    }
+
+def _detect_profile(row0: list, row1: list) -> Tuple[bool, dict]:
+    """Work out the header structure of an unseen layout"""
+    row0_named = sum(_is_named(cell) for cell in row0)
+    row1_named = sum(_is_named(cell) for cell in row1)
     use_double_header = (row0_named > 2) and (row1_named > 2)
-    logger.info(f"Using double header: {use_double_header}")
-
-    # Step 2: Load data based on header structure
-    if use_double_header:
-        combined_headers = []
-        for a, b in zip(row0, row1):
-            if pd.notna(a) and not str(a).startswith("Unnamed"):
-                if pd.notna(b) and not str(b).startswith("Unnamed"):
-                    combined = f"{str(a).strip()} {str(b).strip()}"
-                else:
-                    combined = str(a).strip()
+
+    if not use_double_header:
+        return False, _build_profile([cell.strip() for cell in row0], skiprows=1)
+
+    combined_headers = []
+    for a, b in zip(row0, row1):
+        if a.strip() != '' and not a.startswith("Unnamed"):
+            if b.strip() != '' and not b.startswith("Unnamed"):
+                combined = f"{a.strip()} {b.strip()}"
             else:
-                combined = str(b).strip() if pd.notna(b) else ""
-            combined_headers.append(combined)
+                combined = a.strip()
+        else:
+            combined = b.strip()
+        combined_headers.append(combined)
+    return True, _build_profile(combined_headers, skiprows=2)
 
-        df = pd.read_csv(file_obj, encoding=encoding, skiprows=2, header=None)
-        df.columns = combined_headers
-    else:
-        df = pd.read_csv(file_obj, encoding=encoding)
+def _load_profiles() -> dict:
+    # Caller holds _profiles_lock
+    global _format_profiles
+    if _format_profiles is None:
+        _format_profiles = {}
+        try:
+            with open(FORMAT_PROFILE_PATH) as f:
+                stored = json.load(f)
+            if stored.get('schema') == PROFILE_SCHEMA:
+                _format_profiles = stored['profiles']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable format profiles in {FORMAT_PROFILE_PATH}: {e}")
+    return _format_profiles
 
-    logger.info(f"Initial dataset shape: {df.shape}")
-    logger.info(f"Initial columns: {df.columns.tolist()}")
+def _save_profiles(profiles: dict) -> None:
+    # Caller holds _profiles_lock and passes a copy of the registry
+    try:
+        tmp_path = f"{FORMAT_PROFILE_PATH}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'schema': PROFILE_SCHEMA, 'profiles': profiles}, f, indent=2)
+        os.replace(tmp_path, FORMAT_PROFILE_PATH)
+    except OSError as e:
+        logger.warning(f"Could not save format profiles to {FORMAT_PROFILE_PATH}: {e}")
 
-    # Rename any specific columns manually if needed
-    df.rename(columns={"Vessel code": "vessel_code"}, inplace=True)
-
-    # Step 3: Rename columns to match database schema
-    column_mapping = {
-        "Sector Code": "sector",
-        "Vessel": "vessel",
-        "Total Income (In Lacs) Debit/Credit Amount": "Total_Income",
-        "DOE (In Lacs) Debit/Credit Amount": "DOE",
-        "IOE (In Lacs) Debit/Credit Amount": "IOE",
-        "GOP (In Lacs) Debit/Credit Amount": "GOP",
-        "Profit before Int. & Dep. (In Lacs) Debit/Credit Amount": "PBT",
-        "financial_year": "year",
-        "financial_month": "month"
-    }
+def get_format_profile(header_rows: Tuple[list, list]) -> dict:
+    """
+    Look up the column spec for an export layout by header fingerprint.
     
-    df.rename(columns=column_mapping, inplace=True)
+    Double-header layouts are keyed on both header rows, single-header
+    layouts on the first row only. Unknown layouts are detected and
+    recorded so later files with the same headers skip detection, unless
+    the key would include a data row (it could never match again).
+    
+    Args:
+        header_rows: First two rows of the file (see _sniff_header_rows)
+        
+    Returns:
+        dict: skiprows, usecols, names and text_cols for pd.read_csv
+    """
+    row0, row1 = header_rows
+    double_key = _fingerprint(row0, row1)
+    single_key = _fingerprint(row0)
 
-    # Step 4: Remove blank columns
-    df = df.loc[:, df.columns.str.strip() != '']
+    with _profiles_lock:
+        profiles = _load_profiles()
+        for key in (double_key, single_key):
+            if key in profiles:
+                return profiles[key]
 
-    # Step 5: Process fiscal year/period data
-    fin_month_map = {
-        '001': 'April', '002': 'May', '003': 'June', '004': 'July',
-        '005': 'August', '006': 'September', '007': 'October',
-        '008': 'November', '009': 'December', '010': 'January',
-        '011': 'February', '012': 'March',
-    }
+        use_double_header, profile = _detect_profile(row0, row1)
+        if use_double_header and _looks_like_data(row1):
+            logger.info("Not recording export format profile: its second header row holds data")
+            return profile
+        key = double_key if use_double_header else single_key
+        profiles[key] = profile
+        _save_profiles(dict(profiles))
+    logger.info(f"Recorded new export format profile {key[:12]}: {profile['names']}")
+    return profile
+
+def load_cleaned_data(file: Union[str, io.BytesIO], keep_invalid: bool = False) -> pd.DataFrame:
+    """
+    Load and clean financial data from CSV file.
+    
+    Args:
+        file: File path (string) or file-like object
+        keep_invalid: Keep rows with a missing fiscal period, sector or
+            vessel instead of dropping them, and leave unparseable KPI
+            values as NaN instead of 0, so validate_rows can report them
+        
+    Returns:
+        pd.DataFrame: Cleaned dataframe ready for database insertion
+    """
+    # Step 1: Read the file once and sniff its header rows
+    raw = _read_raw(file)
+    header_rows = _sniff_header_rows(raw)
+
+    # Step 2: Resolve the export layout to a precompiled column spec
+    profile = get_format_profile(header_rows)
+    logger.info(f"Using double header: {profile['skiprows'] == 2}")
+
+    # Steps 3-4: Parse only the needed, already-renamed columns with fixed dtypes
+    df = pd.read_csv(
+        io.BytesIO(raw),
+        encoding=ENCODING,
+        skiprows=profile['skiprows'],
+        header=None,
+        usecols=profile['usecols'],
+        dtype={idx: str for idx in profile['text_cols']},
+    )
+    df.columns = profile['names']
 
+    logger.info(f"Initial dataset shape: {df.shape}")
+    logger.info(f"Initial columns: {df.columns.tolist()}")
+
+    # Step 5: Process fiscal year/period data
     if 'Fiscal year/period' in df.columns:
         # Extract fiscal month code and year
         df['fiscal_month_code'] = df['Fiscal year/period'].astype(str).str.extract(r'/(\d{3})')
         df['financial_year'] = df['Fiscal year/period'].astype(str).str.extract(r'\.(\d{4})')
-        df['financial_month'] = df['fiscal_month_code'].map(fin_month_map)
+        df['financial_month'] = df['fiscal_month_code'].map(FIN_MONTH_MAP)
 
         # Handle missing values
         df['financial_month'] = df['financial_month'].fillna('Unknown')
@@ -116,9 +252,12 @@ def load_cleaned_data(file: Union[str, io.BytesIO]) -> pd.DataFrame:
         df.drop(columns=['fiscal_month_code'], inplace=True)
 
         # Filter out unknown values and convert year to int
-        valid_data = (df['financial_year'] != 'Unknown') & (df['financial_month'] != 'Unknown')
-        df = df[valid_data]
-        df['financial_year'] = df['financial_year'].astype(int)
+        if keep_invalid:
+            df['financial_year'] = pd.to_numeric(df['financial_year'], errors='coerce').astype('Int64')
+        else:
+            valid_data = (df['financial_year'] != 'Unknown') & (df['financial_month'] != 'Unknown')
+            df = df[valid_data]
+            df['financial_year'] = df['financial_year'].astype(int)
         
         # Rename to match expected column names
         df.rename(columns={'financial_year': 'year', 'financial_month': 'month'}, inplace=True)
@@ -130,25 +269,22 @@ def load_cleaned_data(file: Union[str, io.BytesIO]) -> pd.DataFrame:
             df[col] = df[col].replace('', pd.NA)
 
     # Step 7: Clean and convert KPI columns
-    kpi_cols = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
-    for col in kpi_cols:
+    for col in KPI_COLS:
         if col in df.columns:
+            # Blank cells mean zero; anything else must parse as a number
+            blank = df[col].isna() | (df[col].astype(str).str.strip() == '')
             # Handle different number formats
             df[col] = df[col].astype(str).str.replace(',', '')  # Remove commas
             df[col] = df[col].str.replace(r'[^\d.-]', '', regex=True)  # Keep only digits, dots, and minus
             df[col] = pd.to_numeric(df[col], errors='coerce')
-            df[col] = df[col].fillna(0).round(2)  # Fill NaN with 0
+            if keep_invalid:
+                # Leave unparseable values as NaN for validate_rows to reject
+                df[col] = df[col].mask(blank, 0).round(2)
+            else:
+                df[col] = df[col].fillna(0).round(2)  # Fill NaN with 0
 
     # Step 8: Drop unnecessary columns
-    cols_to_drop = [
-        "Segment", "Voyage Number", "Fiscal year/period",
-        "Depreciation (In Lacs) Debit/Credit Amount",
-        "Profit After Depreciation (In Lacs) Debit/Credit Amount",
-        "Finance Cost (In Lacs) Debit/Credit Amount",
-        "Exchange Gain/Loss (In Lacs) Debit/Credit Amount"
-    ]
-    
-    for col in cols_to_drop:
+    for col in COLS_TO_DROP + ["Fiscal year/period"]:
         if col in df.columns:
             df.drop(columns=col, inplace=True)
 
@@ -156,15 +292,15 @@ def load_cleaned_data(file: Union[str, io.BytesIO]) -> pd.DataFrame:
     required_columns = ['year', 'sector', 'vessel']
     existing_required = [col for col in required_columns if col in df.columns]
     
-    if existing_required:
+    if existing_required and not keep_invalid:
         df = df.dropna(subset=existing_required)
 
     # Step 10: Final validation and logging
     logger.info(f"Final dataset shape: {df.shape}")
     if 'year' in df.columns:
-        logger.info(f"Unique years: {sorted(df['year'].unique())}")
+        logger.info(f"Unique years: {sorted(df['year'].dropna().unique())}")
     if 'sector' in df.columns:
-        logger.info(f"Unique sectors: {sorted(df['sector'].unique())}")
+        logger.info(f"Unique sectors: {sorted(df['sector'].dropna().unique())}")
     if 'vessel' in df.columns:
         logger.info(f"Unique vessels: {len(df['vessel'].unique())} vessels")
 
@@ -195,12 +331,12 @@ def validate_data(df: pd.DataFrame) -> bool:
         issues.append("Dataframe is empty")
     
     # Check for duplicate rows
-    if df.duplicated().sum() > 0:
-        issues.append(f"Found {df.duplicated().sum()} duplicate rows")
+    duplicate_count = df.duplicated().sum()
+    if duplicate_count > 0:
+        issues.append(f"Found {duplicate_count} duplicate rows")
     
     # Check for negative values in income columns (might be valid, but worth noting)
-    kpi_cols = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
-    for col in kpi_cols:
+    for col in KPI_COLS:
         if col in df.columns:
             negative_count = (df[col] < 0).sum()
             if negative_count > 0:
@@ -214,6 +350,88 @@ def validate_data(df: pd.DataFrame) -> bool:
     logger.info("Data validation passed")
     return True
 
+def check_schema(df: pd.DataFrame) -> None:
+    """
+    Reject an upload whose headers do not map onto the database schema.
+    
+    Raises:
+        ValueError: If any required column is missing
+    """
+    missing_cols = [col for col in REQUIRED_COLS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(
+            f"Missing required columns: {missing_cols}. "
+            f"Found columns: {df.columns.tolist()}"
+        )
+
+def validate_rows(df: pd.DataFrame,
+                  existing: Optional[pd.DataFrame] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split an upload into rows safe to insert and rows to quarantine.
+    
+    Every check is a vectorised mask over the whole frame; a row's reasons
+    are accumulated from all failing masks in a single pass.
+    
+    Args:
+        df: Dataframe from load_cleaned_data(..., keep_invalid=True)
+        existing: Rows already stored for the same years, used to reject
+            re-uploads of data already in the database
+        
+    Returns:
+        tuple: (accepted, rejected) where rejected carries a 'reject_reason' column
+    
+    Raises:
+        ValueError: If required columns are missing (see check_schema)
+    """
+    check_schema(df)
+    
+    year = pd.to_numeric(df['year'], errors='coerce')
+    max_year = date.today().year + MAX_YEAR_AHEAD
+    
+    checks = [
+        (year.isna() | ~df['month'].isin(FIN_MONTH_MAP.values()), "missing or invalid fiscal period"),
+        (year.notna() & ~year.between(MIN_YEAR, max_year), f"year outside {MIN_YEAR}-{max_year}"),
+        (df['sector'].isna() | (df['sector'].astype(str).str.strip() == ''), "missing sector"),
+        (df['vessel'].isna() | (df['vessel'].astype(str).str.strip() == ''), "missing vessel"),
+        (df[KPI_COLS].apply(pd.to_numeric, errors='coerce').isna().any(axis=1), "non-numeric KPI value"),
+        (df.duplicated(keep='first'), "duplicate row in upload"),
+    ]
+    
+    if existing is not None and not existing.empty:
+        key_cols = [col for col in df.columns if col in existing.columns]
+        upload_keys = _comparable(df[key_cols])
+        existing_keys = _comparable(existing[key_cols]).drop_duplicates()
+        already_stored = upload_keys.merge(existing_keys, on=key_cols, how='left', indicator=True)['_merge'] == 'both'
+        checks.append((pd.Series(already_stored.to_numpy(), index=df.index), "already in database"))
+    
+    reasons = pd.Series('', index=df.index)
+    for mask, reason in checks:
+        mask = mask.fillna(True).astype(bool)
+        reasons = reasons.mask(mask, reasons + reason + '; ')
+    
+    rejected_mask = reasons != ''
+    accepted = df[~rejected_mask].copy()
+    if not accepted.empty:
+        accepted['year'] = accepted['year'].astype(int)
+    
+    rejected = df[rejected_mask].copy()
+    rejected['reject_reason'] = reasons[rejected_mask].str.rstrip('; ')
+    
+    logger.info(f"Validation accepted {len(accepted)} rows, rejected {len(rejected)} rows")
+    return accepted, rejected
+
+def _comparable(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalise a frame so uploaded and stored rows compare equal"""
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if col in KPI_COLS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
+        elif col == 'year':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        else:
+            df[col] = df[col].astype('string').fillna('').str.strip()
+    return df
+
 # Example usage
 if __name__ == "__main__":
     try:
@@ -0,0 +1,398 @@
+# database.py
+"""
+SCI KPI Database Module
+Database helpers shared by the dashboard, the upload path and the
+command-line tools. Plain SQLAlchemy only; no Streamlit imports.
+"""
+
+import logging
+import os
+from datetime import date, datetime
+import pandas as pd
+import pyarrow.parquet as pq
+from export import write_parquet
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+KPI_TABLE = "kpi_data"
+DATA_VERSION_TABLE = "kpi_data_version"
+REJECTED_TABLE = "kpi_rejected_rows"
+SUMMARY_TABLE = "kpi_monthly_summary"
+
+# KPI columns summed into the summary table
+SUMMARY_KPI_COLS = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
+SUMMARY_KEYS = ["year", "month", "sector", "vessel"]
+
+# ==============================================
+# SCHEMA
+# ==============================================
+
+def ensure_schema(engine):
+    """
+    Create the side tables the ingest transaction writes to. Run it before
+    that transaction opens: MySQL DDL commits implicitly, which would
+    commit the kpi_data insert ahead of the rest of the ingest.
+    """
+    with engine.begin() as conn:
+        ensure_version_table(conn)
+        ensure_rejected_table(conn)
+        new_summary = not inspect(conn).has_table(SUMMARY_TABLE)
+        ensure_summary_table(conn)
+    if new_summary:
+        # First summary on an existing kpi_data: cover every year once
+        with engine.begin() as conn:
+            if inspect(conn).has_table(KPI_TABLE):
+                rebuild_summary(conn)
+
+def ensure_version_table(conn):
+    """Create the single-row ingest counter table if it does not exist"""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} ("
+        "id INTEGER PRIMARY KEY, "
+        "version BIGINT NOT NULL)"
+    ))
+
+def ensure_rejected_table(conn):
+    """Create the quarantine table for rejected upload rows if it does not exist"""
+    # row_number is reserved in MySQL 8; backticks also work in SQLite
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {REJECTED_TABLE} ("
+        "source_file VARCHAR(255), "
+        "`row_number` BIGINT, "
+        "reject_reason TEXT, "
+        "record TEXT, "
+        "rejected_at DATETIME)"
+    ))
+
+# ==============================================
+# DATA VERSION
+# ==============================================
+
+def bump_data_version(conn):
+    """
+    Advance the ingest counter. Call inside the same transaction that
+    writes to kpi_data so readers never see new rows under an old version.
+    External loaders should call this (or run the equivalent UPDATE) too.
+    The table must exist already (see ensure_schema).
+    """
+    result = conn.execute(text(f"UPDATE {DATA_VERSION_TABLE} SET version = version + 1 WHERE id = 1"))
+    if result.rowcount == 0:
+        conn.execute(text(f"INSERT INTO {DATA_VERSION_TABLE} (id, version) VALUES (1, 1)"))
+
+def get_data_version(engine):
+    """
+    Cheap change-detection probe for kpi_data.
+
+    Combines the ingest counter with COUNT(*), so both dashboard uploads and
+    external loads that only append rows are picked up.
+
+    Returns:
+        tuple: (ingest_version, row_count), or None if kpi_data is unreadable
+    """
+    try:
+        with engine.connect() as conn:
+            row_count = conn.execute(text(f"SELECT COUNT(*) FROM {KPI_TABLE}")).scalar()
+            try:
+                version = conn.execute(
+                    text(f"SELECT version FROM {DATA_VERSION_TABLE} WHERE id = 1")
+                ).scalar()
+            except SQLAlchemyError:
+                # Version table not created yet (no upload through the dashboard)
+                version = None
+        return (version or 0, row_count)
+    except SQLAlchemyError as e:
+        logger.error(f"Data version probe failed: {e}")
+        return None
+
+# ==============================================
+# INGEST
+# ==============================================
+
+def load_existing_rows(conn, periods, columns):
+    """
+    Stored kpi_data rows for duplicate checks on upload.
+
+    Only the (year, month) pairs in periods are read, and only the given
+    columns that the table has, so a weekly upload reads the months it
+    touches rather than whole fiscal years.
+
+    Args:
+        conn: Open connection
+        periods: Dataframe with the upload's year and month columns
+        columns: Upload columns the duplicate check compares
+    """
+    if periods.empty or not inspect(conn).has_table(KPI_TABLE):
+        return pd.DataFrame()
+    stored = {col["name"] for col in inspect(conn).get_columns(KPI_TABLE)}
+    columns = [col for col in columns if col in stored]
+    quote = conn.dialect.identifier_preparer.quote
+
+    clauses, params, months_params = [], {}, []
+    pairs = periods[["year", "month"]].dropna().drop_duplicates()
+    for i, (year, months) in enumerate(pairs.groupby("year")["month"]):
+        # One clause per fiscal year keeps partition pruning on MySQL
+        clauses.append(f"(year = :year_{i} AND month IN :months_{i})")
+        params[f"year_{i}"] = int(year)
+        params[f"months_{i}"] = sorted(map(str, months))
+        months_params.append(bindparam(f"months_{i}", expanding=True))
+    if not clauses or not columns:
+        return pd.DataFrame()
+    query = text(
+        f"SELECT {', '.join(quote(col) for col in columns)} FROM {KPI_TABLE} WHERE {' OR '.join(clauses)}"
+    ).bindparams(*months_params)
+    return pd.read_sql(query, con=conn, params=params)
+
+def quarantine_rows(conn, rejected, source_file):
+    """
+    Store rejected upload rows in kpi_rejected_rows with their reasons.
+
+    The original record is kept as JSON so the side table has a fixed
+    schema whatever columns the upload had. The table must exist already
+    (see ensure_schema).
+    """
+    if rejected.empty:
+        return
+    records = rejected.drop(columns=["reject_reason"]).to_json(
+        orient="records", lines=True, date_format="iso"
+    ).splitlines()
+    pd.DataFrame({
+        "source_file": source_file,
+        "row_number": rejected.index.to_numpy(),
+        "reject_reason": rejected["reject_reason"].to_numpy(),
+        "record": records,
+        "rejected_at": datetime.now(),
+    }).to_sql(REJECTED_TABLE, con=conn, if_exists="append", index=False)
+
+# ==============================================
+# MONTHLY SUMMARY TABLE
+# ==============================================
+
+def ensure_summary_table(conn):
+    """Create kpi_monthly_summary if it does not exist"""
+    kpi_defs = ", ".join(f"{col} DOUBLE" for col in SUMMARY_KPI_COLS)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} ("
+        "year INTEGER NOT NULL, "
+        "month VARCHAR(20) NOT NULL, "
+        "sector VARCHAR(255) NOT NULL, "
+        "vessel VARCHAR(255) NOT NULL, "
+        f"{kpi_defs}, "
+        "row_count BIGINT NOT NULL)"
+    ))
+
+def _summary_insert(where=""):
+    # Same grouping and trimming as build_monthly_base on the detail rows
+    sums = ", ".join(f"SUM({col})" for col in SUMMARY_KPI_COLS)
+    return (
+        f"INSERT INTO {SUMMARY_TABLE} ({', '.join(SUMMARY_KEYS + SUMMARY_KPI_COLS)}, row_count) "
+        f"SELECT year, month, TRIM(sector), TRIM(vessel), {sums}, COUNT(*) FROM {KPI_TABLE} "
+        "WHERE year IS NOT NULL AND month IS NOT NULL AND sector IS NOT NULL AND vessel IS NOT NULL"
+        f"{where} GROUP BY year, month, TRIM(sector), TRIM(vessel)"
+    )
+
+def refresh_summary(conn, years):
+    """
+    Recompute the summary rows of the given fiscal years from kpi_data.
+    Call inside the transaction that wrote those years, so the summary
+    never disagrees with the detail rows it was built from. The table
+    must exist already (see ensure_schema).
+    """
+    years = sorted({int(y) for y in years if pd.notna(y)})
+    if not years:
+        return
+    params = {"years": years}
+    conn.execute(
+        text(f"DELETE FROM {SUMMARY_TABLE} WHERE year IN :years").bindparams(
+            bindparam("years", expanding=True)
+        ), params
+    )
+    conn.execute(
+        text(_summary_insert(" AND year IN :years")).bindparams(bindparam("years", expanding=True)),
+        params
+    )
+
+def rebuild_summary(conn):
+    """Recompute the whole summary table from kpi_data (repair / first build)"""
+    conn.execute(text(f"DELETE FROM {SUMMARY_TABLE}"))
+    conn.execute(text(_summary_insert()))
+
+def load_summary_rows(conn, min_year=None):
+    """
+    Read the monthly summary, optionally only from min_year onwards.
+
+    Returns None when the summary is missing or out of step with kpi_data
+    (e.g. rows appended by an external loader), so callers can fall back
+    to aggregating the detail rows.
+    """
+    if not inspect(conn).has_table(SUMMARY_TABLE):
+        return None
+    where = "" if min_year is None else " AND year >= :min_year"
+    params = {} if min_year is None else {"min_year": int(min_year)}
+
+    summarised = conn.execute(
+        text(f"SELECT COALESCE(SUM(row_count), 0) FROM {SUMMARY_TABLE} WHERE 1 = 1{where}"), params
+    ).scalar()
+    detail = conn.execute(text(
+        f"SELECT COUNT(*) FROM {KPI_TABLE} WHERE year IS NOT NULL AND month IS NOT NULL "
+        f"AND sector IS NOT NULL AND vessel IS NOT NULL{where}"
+    ), params).scalar()
+    if int(summarised) != int(detail):
+        logger.warning(
+            f"{SUMMARY_TABLE} covers {summarised} of {detail} detail rows; "
+            "run 'python -m sci_dashboard rebuild-summary'"
+        )
+        return None
+
+    columns = ", ".join(SUMMARY_KEYS + SUMMARY_KPI_COLS)
+    return pd.read_sql(
+        text(f"SELECT {columns} FROM {SUMMARY_TABLE} WHERE 1 = 1{where} ORDER BY year, month, sector, vessel"),
+        con=conn, params=params
+    )
+
+def load_detail_rows(conn, year_range, months=None, sector="All", vessel="All"):
+    """kpi_data rows behind one dashboard selection, for drill-down"""
+    clauses = ["year BETWEEN :from_year AND :to_year"]
+    params = {"from_year": int(year_range[0]), "to_year": int(year_range[1])}
+    if months is not None:
+        clauses.append("month IN :months")
+        params["months"] = list(months)
+    if sector != "All":
+        clauses.append("TRIM(sector) = :sector")
+        params["sector"] = sector
+    if vessel != "All":
+        clauses.append("TRIM(vessel) = :vessel")
+        params["vessel"] = vessel
+    query = text(f"SELECT * FROM {KPI_TABLE} WHERE {' AND '.join(clauses)}")
+    if months is not None:
+        query = query.bindparams(bindparam("months", expanding=True))
+    return pd.read_sql(query, con=conn, params=params)
+
+# ==============================================
+# FISCAL-YEAR PARTITIONS AND RETENTION
+# ==============================================
+
+def current_fiscal_year(today=None):
+    """Fiscal year (April-March, labelled by its starting year) containing today"""
+    today = today or date.today()
+    return today.year if today.month >= 4 else today.year - 1
+
+def window_start_year(years):
+    """First fiscal year of a recent window of `years` years; None means all years"""
+    if not years or years <= 0:
+        return None
+    return current_fiscal_year() - years + 1
+
+def load_kpi_rows(conn, min_year=None):
+    """
+    Read kpi_data, optionally only from min_year onwards. The year
+    predicate lets MySQL prune RANGE partitions.
+    """
+    if min_year is None:
+        return pd.read_sql(text(f"SELECT * FROM {KPI_TABLE}"), con=conn)
+    return pd.read_sql(
+        text(f"SELECT * FROM {KPI_TABLE} WHERE year >= :min_year"),
+        con=conn, params={"min_year": int(min_year)}
+    )
+
+def _is_mysql(conn):
+    return conn.dialect.name in ("mysql", "mariadb")
+
+def _year_partitions(conn):
+    """Names of kpi_data's RANGE partitions (empty if not partitioned)"""
+    rows = conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+        "AND PARTITION_NAME IS NOT NULL"
+    ), {"table": KPI_TABLE})
+    return {row[0] for row in rows}
+
+def _partition_clause(year):
+    return f"PARTITION p{year} VALUES LESS THAN ({year + 1})"
+
+def partition_kpi_table(engine):
+    """
+    Convert kpi_data to one MySQL RANGE partition per fiscal year, plus a
+    catch-all pmax partition. A no-op on other databases.
+    """
+    with engine.begin() as conn:
+        if not _is_mysql(conn):
+            logger.info("Partitioning skipped: only supported on MySQL/MariaDB")
+            return False
+        years = [row[0] for row in conn.execute(
+            text(f"SELECT DISTINCT year FROM {KPI_TABLE} WHERE year IS NOT NULL ORDER BY year")
+        )]
+        clauses = [_partition_clause(int(year)) for year in years]
+        clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        conn.execute(text(f"ALTER TABLE {KPI_TABLE} PARTITION BY RANGE (year) ({', '.join(clauses)})"))
+    logger.info(f"Partitioned {KPI_TABLE} into {len(years)} fiscal-year partitions")
+    return True
+
+def ensure_year_partitions(engine, years):
+    """
+    Split dedicated partitions out of pmax for new fiscal years. Run it
+    outside the ingest transaction: MySQL DDL commits implicitly.
+    """
+    with engine.begin() as conn:
+        if not _is_mysql(conn):
+            return
+        existing = _year_partitions(conn)
+        if "pmax" not in existing:
+            return
+        missing = sorted({int(y) for y in years if pd.notna(y)} - {int(p[1:]) for p in existing if p != "pmax"})
+        last_year = max((int(p[1:]) for p in existing if p != "pmax"), default=None)
+        new_years = [year for year in missing if last_year is None or year > last_year]
+        if not new_years:
+            return
+        clauses = [_partition_clause(year) for year in new_years]
+        clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        conn.execute(text(
+            f"ALTER TABLE {KPI_TABLE} REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})"
+        ))
+
+def archive_years(engine, before_year, archive_dir, compression="zstd"):
+    """
+    Move every fiscal year older than before_year out of kpi_data into
+    compressed Parquet files (one per year) in archive_dir.
+
+    Each file is written and its row count verified before the year is
+    removed from the table (DROP PARTITION on partitioned MySQL tables,
+    DELETE otherwise).
+
+    Returns:
+        list: (year, rows, path) for each archived year
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    ensure_schema(engine)
+    archived = []
+    with engine.connect() as conn:
+        years = [int(row[0]) for row in conn.execute(
+            text(f"SELECT DISTINCT year FROM {KPI_TABLE} WHERE year < :year ORDER BY year"),
+            {"year": int(before_year)}
+        )]
+
+    for year in years:
+        with engine.connect() as conn:
+            df = pd.read_sql(
+                text(f"SELECT * FROM {KPI_TABLE} WHERE year = :year"),
+                con=conn, params={"year": year}
+            )
+        path = os.path.join(archive_dir, f"{KPI_TABLE}_fy{year}.parquet")
+        write_parquet(df, path, compression=compression)
+        if pq.ParquetFile(path).metadata.num_rows != len(df):
+            raise RuntimeError(f"Archive of fiscal year {year} is incomplete: {path}")
+
+        with engine.begin() as conn:
+            if _is_mysql(conn) and f"p{year}" in _year_partitions(conn):
+                conn.execute(text(f"ALTER TABLE {KPI_TABLE} DROP PARTITION p{year}"))
+            else:
+                conn.execute(text(f"DELETE FROM {KPI_TABLE} WHERE year = :year"), {"year": year})
+        with engine.begin() as conn:
+            if inspect(conn).has_table(SUMMARY_TABLE):
+                conn.execute(text(f"DELETE FROM {SUMMARY_TABLE} WHERE year = :year"), {"year": year})
+            bump_data_version(conn)
+
+        logger.info(f"Archived fiscal year {year}: {len(df)} rows -> {path}")
+        archived.append((year, len(df), path))
+    return archived
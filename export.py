@@ -0,0 +1,67 @@
+# export.py
+"""
+SCI KPI Export Module
+Chunked writers that turn a filtered or aggregated frame into a compressed
+download (gzip CSV or Parquet) without first rendering the whole frame to
+one in-memory text blob.
+"""
+
+import gzip
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows serialised per chunk / Parquet row group
+EXPORT_CHUNK_ROWS = 50_000
+
+EXPORT_FORMATS = {
+    "CSV (gzip)": {"extension": "csv.gz", "mime": "application/gzip"},
+    "Parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+def iter_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield successive row slices of df (views, not copies)"""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def write_csv_gzip(df, sink, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Stream df into sink as gzip-compressed CSV, one chunk at a time"""
+    with gzip.GzipFile(fileobj=sink, mode="wb") as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        header = True
+        for chunk in iter_chunks(df, chunk_rows):
+            chunk.to_csv(text, index=False, header=header)
+            header = False
+        if header:
+            # Empty frame: still emit the column names
+            df.head(0).to_csv(text, index=False)
+        text.flush()
+        text.detach()
+
+def write_parquet(df, sink, chunk_rows=EXPORT_CHUNK_ROWS, compression="snappy"):
+    """Stream df into sink as Parquet, one row group per chunk"""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(sink, schema, compression=compression) as writer:
+        for chunk in iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def export_bytes(df, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Serialise df for download.
+
+    Args:
+        df: Frame to export
+        fmt: Key of EXPORT_FORMATS
+        chunk_rows: Rows written per chunk
+
+    Returns:
+        bytes: Compressed file contents
+    """
+    sink = io.BytesIO()
+    if fmt == "CSV (gzip)":
+        write_csv_gzip(df, sink, chunk_rows)
+    elif fmt == "Parquet":
+        write_parquet(df, sink, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return sink.getvalue()
@@ -1,9 +1,11 @@
 from firebase_admin import firestore
 import streamlit as st 
+import streamlit.components.v1 as components
 import firebase_admin
 import pyrebase
 from datetime import datetime
 from sci_dashboard import sci_kpi_dashboard  # Adjust if the dashboard function is in a different file
+from auth_session import SESSION_MAX_AGE, PublicKeyCache, SessionStore
 
 from firebase_admin import credentials
 from firebase_admin import auth
@@ -34,6 +36,39 @@ def is_approved_user(email):
     doc = doc_ref.get()
     return doc.exists
 
+@st.cache_resource
+def get_session_store():
+    """Token sessions shared by all browser sessions of this server (see auth_session.py)"""
+    return SessionStore(PublicKeyCache(), firebaseConfig['projectId'], auth.refresh, is_approved_user)
+
+# Browser cookie holding the session id (kept out of the URL, so it does
+# not end up in history, Referer headers or shared links)
+SESSION_COOKIE = "sci_session"
+
+def client_identity():
+    """What a session is bound to: a copied session id fails from another browser"""
+    return st.context.headers.get("User-Agent", "")
+
+def write_session_cookie(value, max_age):
+    # st.context.cookies is read-only; set the cookie on the app's own page
+    components.html(f"""
+    <script>
+    window.parent.document.cookie = "{SESSION_COOKIE}={value}; Max-Age={max_age}; Path=/; SameSite=Strict"
+        + (window.parent.location.protocol === "https:" ? "; Secure" : "");
+    </script>
+    """, height=0)
+
+def forget_session():
+    """Sign this browser session out locally; the server-side session is left alone"""
+    st.session_state.is_logged_in = False
+    st.session_state.email = ""
+    st.session_state.session_id = None
+    st.session_state.session_cookie = ""
+
+def logout():
+    get_session_store().revoke(st.session_state.get("session_id"))
+    forget_session()
+
 # SCI Login Page
 
 st.set_page_config(page_title="SCI Dashboard", layout="wide")
@@ -44,9 +79,30 @@ if "is_logged_in" not in st.session_state:
     st.session_state.is_logged_in = False
 if "email" not in st.session_state:
     st.session_state.email = ""
+if "session_id" not in st.session_state:
+    # A browser refresh starts a new Streamlit session; the session cookie
+    # lets it resume without signing in again
+    st.session_state.session_id = st.context.cookies.get(SESSION_COOKIE)
+
+# Token checks are local; refreshes and approval re-checks run in the background
+if st.session_state.session_id:
+    session_email = get_session_store().resume(st.session_state.session_id, client_identity())
+    if session_email:
+        st.session_state.is_logged_in = True
+        st.session_state.email = session_email
+    else:
+        # Not revoked here: a copied cookie from another browser must not
+        # end the rightful user's session
+        forget_session()
+
+# Cookie change queued by login ("<sid>") or logout (""), written once
+if "session_cookie" in st.session_state:
+    value = st.session_state.pop("session_cookie")
+    write_session_cookie(value, SESSION_MAX_AGE if value else 0)
 
 # ---------- DASHBOARD ----------
 if st.session_state.is_logged_in:
+    st.sidebar.button("🚪 Logout", on_click=logout)
     sci_kpi_dashboard()
     st.stop()
 
@@ -64,8 +120,11 @@ if tab == "🔐 Login":
             user = auth.sign_in_with_email_and_password(email, password)
 
             if is_approved_user(email):
+                session_id = get_session_store().create(user, approved=True, client=client_identity())
                 st.session_state.is_logged_in = True
                 st.session_state.email = email
+                st.session_state.session_id = session_id
+                st.session_state.session_cookie = session_id
                 st.rerun()
             else:
                 st.error("❌ Access denied. You are not approved to use this dashboard.")
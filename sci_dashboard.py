@@ -8,7 +8,20 @@ Import and call sci_kpi_dashboard() from your login page.
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from cleaner import load_cleaned_data
+from cleaner import check_schema, load_cleaned_data, validate_rows
+from export import EXPORT_FORMATS, export_bytes
+from shared_cache import cached_frame, create_backend, drop_stale_versions
+from cache_manager import CacheManager
+from database import (
+    KPI_TABLE, ensure_schema, bump_data_version, get_data_version, load_existing_rows, quarantine_rows,
+    load_kpi_rows, window_start_year, ensure_year_partitions, partition_kpi_table, archive_years,
+    refresh_summary, rebuild_summary, load_summary_rows, load_detail_rows
+)
+from analysis import (
+    KPI_COLS, MONTHS, MONTH_ORDER, QUARTER_MAP, QUARTERS, VIEWS, REPORT_FORMATS, COMPARISONS,
+    add_period_columns, build_dimension_catalog, build_monthly_base, build_report, write_report, months_between,
+    yearly_view, monthly_view, quarterly_view, sector_view, vessel_view, comparison_view
+)
 from sqlalchemy import create_engine
 from urllib.parse import quote_plus
 import os
@@ -21,17 +34,37 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# The loaded dataset is shared by every session (see get_cache_manager), so no
+# code path may write into it. Copy-on-write makes derived frames (filters,
+# column selections) independent of the shared one without eager copies.
+pd.set_option("mode.copy_on_write", True)
+
+# Fiscal years loaded by default (current and previous N-1); 0 loads all years
+YEAR_WINDOW = int(os.getenv("DASHBOARD_YEAR_WINDOW", "3"))
+
+# Byte budget and eviction policy (lru or lfu) for every cached dataset,
+# aggregate, figure and download in this process
+CACHE_BUDGET_MB = int(os.getenv("DASHBOARD_CACHE_BUDGET_MB", "1024"))
+CACHE_POLICY = os.getenv("DASHBOARD_CACHE_POLICY", "lru")
+
+# Emails allowed to open the cache status page (empty: nobody)
+ADMIN_EMAILS = {e.strip() for e in os.getenv("DASHBOARD_ADMIN_EMAILS", "").split(",") if e.strip()}
+
+# Text columns held as Arrow strings: compact, and immutable buffers
+ARROW_STRING_COLS = ["sector", "vessel", "month", "month_year", "quarter"]
+
 # Database configuration (using environment variables)
 DB_CONFIG = {
     "user": os.getenv("DB_USER", "root"),
     "password": os.getenv("DB_PASSWORD", "Stcs@9978"),
     "host": os.getenv("DB_HOST", "localhost"),
     "port": os.getenv("DB_PORT", "3306"),
-    "name": os.getenv("DB_NAME", "sci_db")
+    "name": os.getenv("DB_NAME", "sci_db"),
+    # Full SQLAlchemy URL; overrides the MySQL settings above when set
+    # (e.g. sqlite:///loadtest.db for the load-test stand-in)
+    "url": os.getenv("DB_URL")
 }
 
-# KPI columns
-KPI_COLS = ["Total_Income", "DOE", "IOE", "PBT", "GOP"]
 KPI_COLORS = {
     "Total_Income": "#1f77b4",
     "DOE": "#ff7f0e",
@@ -40,20 +73,9 @@ KPI_COLORS = {
     "GOP": "#9467bd"
 }
 
-# Month names and ordering
-MONTHS = [
-    "January", "February", "March", "April", "May", "June",
-    "July", "August", "September", "October", "November", "December"
-]
-MONTH_ORDER = {month: idx for idx, month in enumerate(MONTHS, start=1)}
-
-# Quarter mapping
-QUARTER_MAP = {
-    "January": "Q1", "February": "Q1", "March": "Q1",
-    "April": "Q2", "May": "Q2", "June": "Q2",
-    "July": "Q3", "August": "Q3", "September": "Q3",
-    "October": "Q4", "November": "Q4", "December": "Q4"
-}
+# Tables above this row count skip pandas Styler (which renders HTML/CSS per
+# cell) and use st.dataframe's native column formatting instead
+STYLER_MAX_ROWS = int(os.getenv("STYLER_MAX_ROWS", "500"))
 
 # ==============================================
 # HELPER FUNCTIONS
@@ -239,37 +261,145 @@ def apply_custom_css():
 @st.cache_resource
 def create_db_engine():
     """Create and cache database engine"""
+    if DB_CONFIG['url']:
+        return create_engine(DB_CONFIG['url'])
     escaped_password = quote_plus(DB_CONFIG['password'])
     return create_engine(
         f"mysql+pymysql://{DB_CONFIG['user']}:{escaped_password}@"
         f"{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['name']}"
     )
 
-@st.cache_data(ttl=3600)
-def load_and_clean_data(_engine):
-    """Load and clean data from database with caching"""
+@st.cache_resource
+def create_shared_cache():
+    """Create and cache the cross-process cache backend (see shared_cache.py)"""
+    return create_backend()
+
+@st.cache_resource
+def get_cache_manager():
+    """Create the process-wide, byte-budgeted cache (see cache_manager.py)"""
+    # Data versions are (ingest counter, row count): only the counter is
+    # monotonic, a row count can drop after an external delete
+    return CacheManager(CACHE_BUDGET_MB * 2**20, CACHE_POLICY, version_order=lambda version: version[0])
+
+def load_and_clean_data(engine, data_version, min_year=None):
+    """
+    Load and clean data from database with caching.
+    data_version (see get_data_version) is the cache key, so the full read
+    only runs again once the table has actually changed.
+
+    The frame is shared across sessions without copying: treat it as
+    read-only. All derived columns are added here, once per data version.
+    Other worker processes reuse it through the shared cache.
+
+    min_year limits the load to recent fiscal years (None loads all).
+    """
+    return get_cache_manager().get_or_build(
+        "dataset", ("kpi_data", data_version, min_year),
+        lambda: cached_frame(
+            create_shared_cache(), f"kpi_data_from_{min_year or 'all'}", data_version,
+            lambda: read_and_clean_data(engine, min_year)
+        ),
+        version=data_version
+    )
+
+def read_and_clean_data(engine, min_year=None):
+    """
+    Read kpi_data from the database and add derived columns.
+    Errors are raised, not returned as an empty frame, so a failed load is
+    never cached; callers report them.
+    """
+    with engine.connect() as conn:
+        df = load_kpi_rows(conn, min_year)
+    
+    # Data cleaning
+    df['year'] = df['year'].astype(int)
+    df['sector'] = df['sector'].astype(str).str.strip()
+    df['vessel'] = df['vessel'].astype(str).str.strip()
+    df = df.dropna(subset=['year', 'sector', 'vessel'])
+    
+    # Add month index, month-year and quarter columns
+    df = add_period_columns(df)
+    return to_arrow_strings(df)
+
+def load_monthly_base(engine, data_version, min_year=None):
+    """
+    Load the year x month x sector x vessel aggregate every view is built from.
+    Shared across sessions like load_and_clean_data; treat it as read-only.
+    It has the highest priority in the cache manager.
+
+    Read from kpi_monthly_summary, so the load scales with periods and
+    vessels rather than detail rows. The detail table is aggregated here
+    only when the summary is missing or out of step.
+    """
+    def build():
+        summary = read_summary_base(engine, min_year)
+        if summary is not None:
+            return summary
+        df = load_and_clean_data(engine, data_version, min_year)
+        if df.empty:
+            return df
+        return to_arrow_strings(build_monthly_base(df))
+
+    return get_cache_manager().get_or_build(
+        "base", ("monthly_base", data_version, min_year),
+        lambda: cached_frame(
+            create_shared_cache(), f"monthly_base_from_{min_year or 'all'}", data_version, build
+        ),
+        version=data_version
+    )
+
+def read_summary_base(engine, min_year=None):
+    """Monthly base from kpi_monthly_summary, or None to fall back to the detail rows"""
     try:
-        df = pd.read_sql("SELECT * FROM kpi_data", con=_engine)
-        
-        # Data cleaning
-        df['year'] = df['year'].astype(int)
-        df['sector'] = df['sector'].astype(str).str.strip()
-        df['vessel'] = df['vessel'].astype(str).str.strip()
-        df = df.dropna(subset=['year', 'sector', 'vessel'])
-        
-        # Add month index and month-year columns
-        df['month_index'] = df['month'].map(MONTH_ORDER)
-        df["month_year"] = (
-            df["year"].astype(str) + "-" + df["month_index"].astype(str).str.zfill(2)
-        )
-        df["month_year"] = pd.to_datetime(
-            df["month_year"], format="%Y-%m"
-        ).dt.strftime('%b %Y')
-        
-        return df
+        with engine.connect() as conn:
+            df = load_summary_rows(conn, min_year)
     except Exception as e:
-        st.error(f"Error loading data: {e}")
-        return pd.DataFrame()
+        st.warning(f"Summary table unavailable, aggregating detail rows: {e}")
+        return None
+    if df is None or df.empty:
+        return None
+    df['year'] = df['year'].astype(int)
+    return to_arrow_strings(add_period_columns(df))
+
+def load_drill_down(engine, data_version, year_range, months, sector, vessel):
+    """Detail kpi_data rows for one selection; keyed on data_version like the other loaders"""
+    def build():
+        with engine.connect() as conn:
+            return load_detail_rows(conn, year_range, months, sector, vessel)
+
+    with st.spinner("Loading source rows..."):
+        return get_cache_manager().get_or_build(
+            "drill_down", (data_version, year_range, months, sector, vessel), build, version=data_version
+        )
+
+def load_dimension_catalog(engine, data_version, min_year=None):
+    """Years, sectors, vessels and their mappings for the filter widgets"""
+    def build():
+        base = load_monthly_base(engine, data_version, min_year)
+        if base.empty:
+            return build_dimension_catalog(base.reindex(columns=['year', 'month_index', 'sector', 'vessel']))
+        return build_dimension_catalog(base)
+
+    return get_cache_manager().get_or_build(
+        "aggregate", ("catalog", data_version, min_year), build, version=data_version
+    )
+
+def cached_result(category, name, state, build):
+    """
+    Per-selection result (view frame, figure, download) cached under the
+    global budget. Keyed on the loaded base, so it follows data version and
+    year window; treat the result as read-only like the base itself.
+    """
+    base_key = st.session_state.get("base_key")
+    version = base_key[0] if base_key else None
+    return get_cache_manager().get_or_build(category, (name, base_key, state), build, version=version)
+
+def to_arrow_strings(df):
+    """Store text columns as Arrow-backed strings"""
+    for col in ARROW_STRING_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype("string[pyarrow]")
+    return df
 
 def display_kpi_summary(df, kpi_cols):
     """Display KPI summary cards"""
@@ -288,8 +418,8 @@ def display_kpi_summary(df, kpi_cols):
 def create_bar_chart(df, x, y, color=None, facet_col=None, 
                      barmode="group", text_auto=True, width=1000, facet_col_wrap=None):
     """Create standardized bar chart"""
-    # Format bar text
-    df["formatted_text"] = df[y].apply(lambda val: f"{-val:,.2f}")
+    # Format bar text (kept out of df so callers' frames are never modified)
+    formatted_text = (-df[y]).map("{:,.2f}".format)
     
     fig = px.bar(
         df,
@@ -299,7 +429,7 @@ def create_bar_chart(df, x, y, color=None, facet_col=None,
         facet_col=facet_col,
         facet_col_wrap=facet_col_wrap,
         barmode=barmode,
-        text="formatted_text",
+        text=formatted_text,
         width=width,
         color_discrete_map=KPI_COLORS
     )
@@ -326,9 +456,21 @@ def create_bar_chart(df, x, y, color=None, facet_col=None,
     return fig
 
 
-def create_date_filters(df):
+def display_table(df, kpi_cols=KPI_COLS):
+    """Render a KPI table, using Styler only for small frames"""
+    kpi_cols = [col for col in kpi_cols if col in df.columns]
+    if len(df) <= STYLER_MAX_ROWS:
+        st.dataframe(df.style.format({col: "₹{:,.2f}" for col in kpi_cols}))
+    else:
+        # Custom formats are plain printf (no grouping); "accounting" adds
+        # thousands separators while the column stays numeric and sortable
+        st.dataframe(df, column_config={
+            col: st.column_config.NumberColumn(f"{col} (₹)", format="accounting") for col in kpi_cols
+        })
+
+def create_date_filters(catalog):
     """Create standardized date filters"""
-    years = sorted(df['year'].unique().tolist())
+    years = catalog["years"]
     with st.sidebar.expander("📆 Date Range", expanded=True):
         from_year = st.selectbox("From Year", years, key="from_year")
         to_year = st.selectbox("To Year", [y for y in years if y >= from_year], key="to_year")
@@ -338,159 +480,180 @@ def create_date_filters(df):
                                 key="to_month")
     return from_year, to_year, from_month, to_month
 
-def create_sector_vessel_filters(df):
-    """Create sector and vessel filters"""
-    sectors = sorted(df['sector'].unique().tolist())
-    vessels = sorted(df['vessel'].unique().tolist())
-    
+def create_sector_vessel_filters(catalog):
+    """Create sector and vessel filters (vessels narrowed to the chosen sector)"""
     with st.sidebar.expander("🔍 Additional Filters", expanded=True):
-        selected_sector = st.selectbox("Select Sector", ["All"] + sectors, key="sector")
+        selected_sector = st.selectbox("Select Sector", ["All"] + catalog["sectors"], key="sector")
+        if selected_sector == "All":
+            vessels = catalog["vessels"]
+        else:
+            vessels = catalog["sector_vessels"].get(selected_sector, [])
         selected_vessel = st.selectbox("Select Vessel", ["All"] + vessels, key="vessel")
     
     return selected_sector, selected_vessel
 
+def build_export(df, fmt, filter_state):
+    """Serialise a filtered frame once per (filter state, format)"""
+    with st.spinner("Preparing download..."):
+        return cached_result("export", fmt, filter_state, lambda: export_bytes(df, fmt))
+
+def render_export_controls(df, filter_state, name):
+    """Offer the frame as a compressed download, built only when requested"""
+    st.markdown("### ⬇️ Export")
+    fmt = st.radio("Export Format", list(EXPORT_FORMATS), horizontal=True, key=f"export_fmt_{name}")
+    request = (name, fmt, filter_state, st.session_state.get("data_version"))
+
+    if st.button("Prepare Download", key=f"export_prepare_{name}"):
+        st.session_state["export_request"] = request
+
+    if st.session_state.get("export_request") == request:
+        spec = EXPORT_FORMATS[fmt]
+        st.download_button(
+            f"Download {fmt}",
+            data=build_export(df, fmt, request),
+            file_name=f"sci_{name}.{spec['extension']}",
+            mime=spec["mime"],
+            key=f"export_download_{name}"
+        )
+
+def render_drill_down(year_range, sector, vessel, months=None):
+    """
+    Source rows behind the current selection, read from kpi_data on request.
+    months limits the rows to the selected months (None: whole years).
+    """
+    with st.expander("🔎 Drill down to source rows", expanded=False):
+        if not st.checkbox("Load source rows", key="drill_down"):
+            st.caption("Views are built from the monthly summary; source rows are loaded on request.")
+            return
+        detail_df = load_drill_down(create_db_engine(), st.session_state.get("data_version"),
+                                    year_range, None if months is None else tuple(months),
+                                    sector, vessel)
+        st.caption(f"{len(detail_df):,} rows")
+        display_table(detail_df)
+
 def create_data_preview(df, title):
     """Create styled data preview"""
     with st.expander(f"📋 {title}", expanded=False):
-        st.dataframe(df.style.format({col: "₹{:,.2f}" for col in KPI_COLS}))
-
-def filter_data(df, year_range, month_range, sector, vessel):
-    """Apply common filters to dataframe"""
-    # Year filter
-    filtered = df[(df['year'] >= year_range[0]) & (df['year'] <= year_range[1])]
-    
-    # Month filter (apply only if 'month' column is present)
-    if 'month' in df.columns:
-        from_idx = MONTH_ORDER[month_range[0]]
-        to_idx = MONTH_ORDER[month_range[1]]
-        months_in_range = [m for m in MONTHS if MONTH_ORDER[m] >= from_idx and MONTH_ORDER[m] <= to_idx]
-        filtered = filtered[filtered['month'].isin(months_in_range)]
-
-    # Sector filter
-    if sector != "All":
-        filtered = filtered[filtered['sector'] == sector]
-    
-    # Vessel filter
-    if vessel != "All":
-        filtered = filtered[filtered['vessel'] == vessel]
-    
-    return filtered
+        display_table(df)
 
 # ==============================================
 # ANALYSIS FUNCTIONS
 # ==============================================
 
-def yearly_analysis(df):
+def yearly_analysis(df, catalog):
     """Optimized yearly analysis"""
     # Create filters
     with st.sidebar.expander("🔍 Analysis Filters", expanded=True):
-        years = sorted(df['year'].unique().tolist())
+        years = catalog["years"]
         from_year = st.selectbox("From Year", years, key="y_from_year")
         to_year = st.selectbox("To Year", [y for y in years if y >= from_year], key="y_to_year")
-        selected_sector, selected_vessel = create_sector_vessel_filters(df)
+        comparison = create_comparison_filter("yearly", key="y_compare")
+        selected_sector, selected_vessel = create_sector_vessel_filters(catalog)
+
+    if comparison != "Off":
+        render_comparison(df, "yearly", comparison, "year", (from_year, to_year),
+                          sector=selected_sector, vessel=selected_vessel)
+        return
 
     # Data processing
-    grouped_df = df.groupby(['year', 'sector', 'vessel'])[KPI_COLS].sum().reset_index()
-    
-    # Filter data
-    filtered_df = filter_data(
-        grouped_df, 
-        (from_year, to_year),
-        ("January", "December"),  # Full year
-        selected_sector,
-        selected_vessel
-    )
+    filter_state = (from_year, to_year, selected_sector, selected_vessel)
+    filtered_df = cached_result("aggregate", "yearly", filter_state,
+                                lambda: yearly_view(df, (from_year, to_year), selected_sector, selected_vessel))
     
     # Display results
-    render_analysis_results(filtered_df, "year", "Show Filtered Data")
+    render_analysis_results(filtered_df, "year", "Show Filtered Data",
+                            filter_state=filter_state, export_name="yearly")
+    render_drill_down((from_year, to_year), selected_sector, selected_vessel)
 
-def monthly_analysis(df):
+def monthly_analysis(df, catalog):
     """Optimized monthly analysis"""
     # Create filters
     # Custom monthly filter logic:
-    from_year, to_year = sorted(df['year'].unique().tolist())[0], sorted(df['year'].unique().tolist())[-1]
+    years = catalog["years"]
     with st.sidebar.expander("📆 Date Range", expanded=True):
-        from_year = st.selectbox("From Year", sorted(df['year'].unique().tolist()), key="m_from_year")
-        to_year = st.selectbox("To Year", [y for y in sorted(df['year'].unique().tolist()) if y >= from_year], key="m_to_year")
+        from_year = st.selectbox("From Year", years, key="m_from_year")
+        to_year = st.selectbox("To Year", [y for y in years if y >= from_year], key="m_to_year")
         if from_year == to_year:
-            from_month = st.selectbox("From Month", MONTHS, key="m_from_month")
+            # Only months that have data in the chosen year
+            months = catalog["months_by_year"][from_year]
+            from_month = st.selectbox("From Month", months, key="m_from_month")
             to_month = st.selectbox("To Month", 
-                                    [m for m in MONTHS if MONTH_ORDER[m] >= MONTH_ORDER[from_month]],
+                                    [m for m in months if MONTH_ORDER[m] >= MONTH_ORDER[from_month]],
                                     key="m_to_month")
         else:
             selected_month = st.selectbox("Select One Month", MONTHS, key="m_only_month")
             from_month = to_month = selected_month
-    selected_sector, selected_vessel = create_sector_vessel_filters(df)
+        comparison = create_comparison_filter("monthly", key="m_compare")
+    selected_sector, selected_vessel = create_sector_vessel_filters(catalog)
+
+    if comparison != "Off":
+        render_comparison(df, "monthly", comparison, "month_year", (from_year, to_year),
+                          month_range=(from_month, to_month),
+                          sector=selected_sector, vessel=selected_vessel)
+        return
     
     # Data processing
-    grouped_df = df.groupby(['year', 'month', 'sector', 'vessel'])[KPI_COLS].sum().reset_index()
-    grouped_df["month_index"] = grouped_df["month"].map(MONTH_ORDER)
-    grouped_df["month_year"] = (
-        grouped_df["year"].astype(str) + "-" +
-        grouped_df["month_index"].astype(str).str.zfill(2)
-    )
-    grouped_df["month_year"] = pd.to_datetime(
-        grouped_df["month_year"], format="%Y-%m"
-    ).dt.strftime('%b %Y')
-    
-    # Filter data
-    filtered_df = filter_data(
-        grouped_df,
+    filter_state = (from_year, to_year, from_month, to_month, selected_sector, selected_vessel)
+    filtered_df = cached_result("aggregate", "monthly", filter_state, lambda: monthly_view(
+        df,
         (from_year, to_year),
         (from_month, to_month),
         selected_sector,
         selected_vessel
-    )
+    ))
     
     # Display results
     x_axis = "month_year" if from_year == to_year else "year"
-    render_analysis_results(filtered_df, x_axis, "Show Filtered Monthly Data",barmode="stack")
+    render_analysis_results(filtered_df, x_axis, "Show Filtered Monthly Data",barmode="stack",
+                            filter_state=filter_state, export_name="monthly")
+    render_drill_down((from_year, to_year), selected_sector, selected_vessel,
+                      months=months_between(from_month, to_month))
 
-def quarterly_analysis(df):
+def quarterly_analysis(df, catalog):
     """Optimized quarterly analysis"""
-    # Define quarter options
-    quarter_options = ["Q1", "Q2", "Q3", "Q4"]
-    
     # Create filters
     with st.sidebar.expander("🔍 Analysis Filters", expanded=True):
-        years = sorted(df['year'].unique().tolist())
+        years = catalog["years"]
         from_year = st.selectbox("From Year", years, key="q_from_year")
         to_year = st.selectbox("To Year", [y for y in years if y >= from_year], key="q_to_year")
         
         # Quarter selection
         if from_year == to_year:
-            selected_quarters = st.multiselect("Select Quarter(s)", quarter_options, default=quarter_options)
+            selected_quarters = st.multiselect("Select Quarter(s)", QUARTERS, default=QUARTERS)
         else:
-            selected_quarter = st.selectbox("Select Quarter", quarter_options)
+            selected_quarter = st.selectbox("Select Quarter", QUARTERS)
             selected_quarters = [selected_quarter]
         
-        selected_sector, selected_vessel = create_sector_vessel_filters(df)
+        comparison = create_comparison_filter("quarterly", key="q_compare")
+        selected_sector, selected_vessel = create_sector_vessel_filters(catalog)
+
+    if comparison != "Off":
+        render_comparison(df, "quarterly", comparison, "quarter_year", (from_year, to_year),
+                          quarters=selected_quarters,
+                          sector=selected_sector, vessel=selected_vessel)
+        return
     
     # Data processing
-    df["quarter"] = df["month"].map(QUARTER_MAP)
-    grouped_df = df.groupby(["year", "quarter", "sector", "vessel"])[KPI_COLS].sum().reset_index()
-    grouped_df["quarter_year"] = grouped_df["quarter"] + " " + grouped_df["year"].astype(str)
-
-    # Filter data
-    filtered_df = grouped_df[
-        (grouped_df["year"] >= from_year) &
-        (grouped_df["year"] <= to_year) &
-        (grouped_df["quarter"].isin(selected_quarters))
-    ]
-    
-    if selected_sector != "All":
-        filtered_df = filtered_df[filtered_df["sector"] == selected_sector]
-    if selected_vessel != "All":
-        filtered_df = filtered_df[filtered_df["vessel"] == selected_vessel]
+    filter_state = (from_year, to_year, tuple(selected_quarters), selected_sector, selected_vessel)
+    filtered_df = cached_result("aggregate", "quarterly", filter_state, lambda: quarterly_view(
+        df,
+        (from_year, to_year),
+        selected_quarters,
+        selected_sector,
+        selected_vessel
+    ))
 
     # Display results
     x_axis = "quarter" if from_year == to_year else "year"
-    render_analysis_results(filtered_df, x_axis, "Show Filtered Quarterly Data")
+    render_analysis_results(filtered_df, x_axis, "Show Filtered Quarterly Data",
+                            filter_state=filter_state, export_name="quarterly")
+    render_drill_down((from_year, to_year), selected_sector, selected_vessel,
+                      months=[m for m in MONTHS if QUARTER_MAP[m] in selected_quarters])
 
-def sector_wise_analysis(df):
+def sector_wise_analysis(df, catalog):
     """Optimized sector-wise analysis"""
-    from_year, to_year, from_month, to_month = create_date_filters(df)
-    sectors = sorted(df['sector'].unique().tolist())
+    from_year, to_year, from_month, to_month = create_date_filters(catalog)
+    sectors = catalog["sectors"]
     with st.sidebar.expander("🔍 Additional Filters", expanded=True):
         if from_year == to_year:
             selected_sectors = st.multiselect("Select Sector(s)", sectors, default=sectors, key="sector_only_multi")
@@ -498,25 +661,18 @@ def sector_wise_analysis(df):
             selected_sector = st.selectbox("Select One Sector", sectors, key="sector_only_single")
             selected_sectors = [selected_sector]
     # Data processing
-    grouped_df = df.groupby(['year', 'sector', 'month'])[KPI_COLS].sum().reset_index()
-    # Filter data
-    filtered_df = filter_data(
-        grouped_df,
-        (from_year, to_year),
-        (from_month, to_month),
-        "All",  # Sector will be filtered below
-        "All"   # All vessels
-    )
-    if selected_sectors != ["All"]:
-        filtered_df = filtered_df[filtered_df["sector"].isin(selected_sectors)]
+    filter_state = (from_year, to_year, from_month, to_month, tuple(selected_sectors))
+    filtered_df = cached_result("aggregate", "sector_wise", filter_state,
+                                lambda: sector_view(df, (from_year, to_year), (from_month, to_month), selected_sectors))
     # Display results
     x_axis = "sector" if from_year == to_year else "year"
-    render_analysis_results(filtered_df,x_axis,"Show Filtered Sector-wise Data",barmode="stack")
+    render_analysis_results(filtered_df,x_axis,"Show Filtered Sector-wise Data",barmode="stack",
+                            filter_state=filter_state, export_name="sector_wise")
 
-def vessel_wise_analysis(df):
+def vessel_wise_analysis(df, catalog):
     """Optimized vessel-wise analysis"""
-    from_year, to_year, from_month, to_month = create_date_filters(df)
-    vessels = sorted(df['vessel'].unique().tolist())
+    from_year, to_year, from_month, to_month = create_date_filters(catalog)
+    vessels = catalog["vessels"]
     with st.sidebar.expander("🔍 Additional Filters", expanded=True):
         if from_year == to_year:
             selected_vessels = st.multiselect("Select Vessel(s)", vessels, default=vessels, key="vessel_only")
@@ -524,22 +680,55 @@ def vessel_wise_analysis(df):
             selected_vessel = st.selectbox("Select One Vessel", vessels, key="vessel_only_single")
             selected_vessels = [selected_vessel]
     # Data processing
-    grouped_df = df.groupby(['year', 'vessel', 'month'])[KPI_COLS].sum().reset_index()
-    # Filter data
-    filtered_df = filter_data(
-        grouped_df,
-        (from_year, to_year),
-        (from_month, to_month),
-        "All",  # All sectors
-        "All"  # We'll filter vessel(s) below
-    )
-    if selected_vessels != ["All"]:
-        filtered_df = filtered_df[filtered_df["vessel"].isin(selected_vessels)]
+    filter_state = (from_year, to_year, from_month, to_month, tuple(selected_vessels))
+    filtered_df = cached_result("aggregate", "vessel_wise", filter_state,
+                                lambda: vessel_view(df, (from_year, to_year), (from_month, to_month), selected_vessels))
     # Display results
     x_axis = "vessel" if from_year == to_year else "year"
-    render_analysis_results(filtered_df, x_axis, "Show Filtered Vessel-wise Data",barmode="stack")
+    render_analysis_results(filtered_df, x_axis, "Show Filtered Vessel-wise Data",barmode="stack",
+                            filter_state=filter_state, export_name="vessel_wise")
+
+def create_comparison_filter(view, key):
+    """Select a period-over-period comparison mode for a view"""
+    return st.radio("Compare", ["Off"] + list(COMPARISONS[view]), horizontal=True, key=key)
+
+def render_comparison(df, view, comparison, x_axis, year_range, month_range=("January", "December"),
+                      quarters=QUARTERS, sector="All", vessel="All"):
+    """Render period-over-period deltas for the fleet total and per vessel"""
+    lag = COMPARISONS[view][comparison]
+    filters = dict(month_range=month_range, quarters=quarters, sector=sector, vessel=vessel)
+    state = (year_range, month_range, tuple(quarters), sector, vessel)
+    name = f"{view}_{comparison.lower()}"
+    totals_df = cached_result("aggregate", f"{name}_totals", state,
+                              lambda: comparison_view(df, view, lag, year_range, keys=(), **filters))
+    detail_df = cached_result("aggregate", name, state,
+                              lambda: comparison_view(df, view, lag, year_range, **filters))
 
-def render_analysis_results(df, x_axis, preview_title,barmode="group"):
+    if detail_df.empty:
+        st.warning("⚠️ No data matches your filter criteria.")
+        return
+
+    st.markdown(f"### 🔁 {comparison} Change")
+    fig = cached_result("figure", name, (state, x_axis), lambda: build_delta_chart(totals_df, x_axis))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.markdown(f"### 📋 {comparison} Change by Vessel")
+    display_table(detail_df, [col for kpi in KPI_COLS for col in (kpi, f"{kpi}_prior", f"{kpi}_delta")])
+
+    render_export_controls(detail_df, (view, comparison) + state, name)
+
+def build_delta_chart(totals_df, x_axis):
+    """Bar chart of each KPI's period-over-period delta"""
+    delta_cols = [f"{kpi}_delta" for kpi in KPI_COLS]
+    long_df = pd.melt(totals_df, id_vars=[x_axis], value_vars=delta_cols,
+                      var_name="KPI", value_name="Value")
+    long_df["KPI"] = long_df["KPI"].str.removesuffix("_delta")
+    fig = create_bar_chart(long_df.dropna(subset=["Value"]), x=x_axis, y="Value", color="KPI")
+    if x_axis == "year":
+        fig.update_layout(xaxis=dict(tickmode='linear', dtick=1))
+    return fig
+
+def render_analysis_results(df, x_axis, preview_title,barmode="group", filter_state=(), export_name="data"):
     """Render common analysis results (replaces repeated code)"""
     if df.empty:
         st.warning("⚠️ No data matches your filter criteria.")
@@ -551,15 +740,11 @@ def render_analysis_results(df, x_axis, preview_title,barmode="group"):
     viz_type = st.radio("Chart Type", ["Multi-KPI Bar Chart", "Table"], horizontal=True, index=0, key=f"viz_{x_axis}")
     
     if viz_type == "Multi-KPI Bar Chart":
-        aggregated_df = df.groupby(x_axis)[KPI_COLS].sum().reset_index()
-        long_df = pd.melt(aggregated_df, id_vars=[x_axis], value_vars=KPI_COLS,
-                          var_name="KPI", value_name="Value")
-        fig = create_bar_chart(long_df, x=x_axis, y="Value", color="KPI",barmode=barmode)
-        if x_axis == "year":
-            fig.update_layout(xaxis=dict(tickmode='linear', dtick=1))
+        fig = cached_result("figure", f"{export_name}_trend", (filter_state, x_axis, barmode),
+                            lambda: build_trend_chart(df, x_axis, barmode))
         st.plotly_chart(fig, use_container_width=True)
     else:
-        st.dataframe(df.style.format({col: "₹{:,.2f}" for col in KPI_COLS}))
+        display_table(df)
     
     # Individual KPI analysis
     st.markdown("### 📊 Individual KPI Analysis")
@@ -571,48 +756,152 @@ def render_analysis_results(df, x_axis, preview_title,barmode="group"):
         kpi_df["value"] = kpi_df[kpi].apply(lambda val: f"{-val:,.2f}")
         
         with tab1:
-            fig = px.bar(
-                kpi_df, 
-                x=x_axis, 
-                y=kpi_df[kpi]* -1,
-                text="value",
-                color_discrete_sequence=[KPI_COLORS[kpi]]
-            )
-            if x_axis == "year":
-                fig.update_layout(xaxis=dict(tickmode='linear', dtick=1))
-            fig.update_traces(width=0.7)
-            fig.update_layout(
-                title=f"{kpi} Trend",
-                xaxis_title=x_axis.replace("_", " ").title(),
-                yaxis_title="₹ (Lacs)",
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='white')
-            )
+            fig = cached_result("figure", f"{export_name}_{kpi}", (filter_state, x_axis),
+                                lambda: build_kpi_chart(kpi_df, x_axis, kpi))
             st.plotly_chart(fig, use_container_width=True)
             
         with tab2:
-            st.dataframe(kpi_df.style.format({kpi: "₹{:,.2f}"}))
+            display_table(kpi_df, [kpi])
+
+    render_export_controls(df, filter_state, export_name)
+
+def build_trend_chart(df, x_axis, barmode):
+    """Multi-KPI bar chart of df summed over x_axis"""
+    aggregated_df = df.groupby(x_axis)[KPI_COLS].sum().reset_index()
+    long_df = pd.melt(aggregated_df, id_vars=[x_axis], value_vars=KPI_COLS,
+                      var_name="KPI", value_name="Value")
+    fig = create_bar_chart(long_df, x=x_axis, y="Value", color="KPI",barmode=barmode)
+    if x_axis == "year":
+        fig.update_layout(xaxis=dict(tickmode='linear', dtick=1))
+    return fig
+
+def build_kpi_chart(kpi_df, x_axis, kpi):
+    """Single-KPI trend bar chart"""
+    fig = px.bar(
+        kpi_df, 
+        x=x_axis, 
+        y=kpi_df[kpi]* -1,
+        text="value",
+        color_discrete_sequence=[KPI_COLORS[kpi]]
+    )
+    if x_axis == "year":
+        fig.update_layout(xaxis=dict(tickmode='linear', dtick=1))
+    fig.update_traces(width=0.7)
+    fig.update_layout(
+        title=f"{kpi} Trend",
+        xaxis_title=x_axis.replace("_", " ").title(),
+        yaxis_title="₹ (Lacs)",
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white')
+    )
+    return fig
 
 def handle_csv_upload(engine):
     """Handle CSV upload functionality"""
     st.markdown("## 📤 Upload Weekly KPI CSV File")
     uploaded_file = st.file_uploader("Upload your KPI CSV", type=["csv"])
     
-    if uploaded_file is not None:
+    if uploaded_file is None:
+        return
+
+    # The uploader keeps its file across reruns; ingest each upload only once
+    if st.session_state.get("ingested_upload") != uploaded_file.file_id:
         try:
-            df_uploaded = load_cleaned_data(uploaded_file)
-            df_uploaded.to_sql("kpi_data", con=engine, if_exists='append', index=False)
-            st.success(f"✅ Uploaded and saved {len(df_uploaded)} rows to the database.")
-            
-            # Clear cache to show updated data
-            st.cache_data.clear()
-            
-            # Display uploaded data
-            with st.expander("View Uploaded Data", expanded=True):
-                st.dataframe(df_uploaded.style.format({col: "₹{:,.2f}" for col in KPI_COLS}))
+            accepted, rejected = ingest_upload(engine, uploaded_file, uploaded_file.name)
         except Exception as e:
             st.error(f"❌ Failed to process: {e}")
+            return
+        st.session_state["ingested_upload"] = uploaded_file.file_id
+        st.session_state["upload_result"] = (accepted, rejected)
+
+    # Cached loads are keyed on the data version, so the next
+    # dashboard rerun picks up the new rows without a cache clear
+    accepted, rejected = st.session_state["upload_result"]
+    st.success(f"✅ Uploaded and saved {len(accepted)} rows to the database.")
+    if not rejected.empty:
+        st.warning(f"⚠️ {len(rejected)} rows were rejected and quarantined in kpi_rejected_rows.")
+        with st.expander("View Rejected Rows", expanded=True):
+            display_table(rejected)
+
+    # Display uploaded data
+    with st.expander("View Uploaded Data", expanded=True):
+        display_table(accepted)
+
+def ingest_upload(engine, file, source_name):
+    """
+    Clean, validate and store an uploaded KPI file in one transaction,
+    together with the summary rows of the fiscal years it touched.
+
+    Returns:
+        tuple: (accepted, rejected) dataframes
+    """
+    df_uploaded = load_cleaned_data(file, keep_invalid=True)
+    check_schema(df_uploaded)
+    # Partitions only for years of rows that pass the row checks: a typo
+    # year that is rejected later must not leave a permanent partition.
+    # Duplicates are checked against stored rows in the transaction below.
+    valid_rows, _ = validate_rows(df_uploaded, None)
+    ensure_year_partitions(engine, valid_rows['year'].unique())
+    # DDL first: on MySQL it would commit the transaction below early
+    ensure_schema(engine)
+    with engine.begin() as conn:
+        # Only rows that can be accepted need checking against stored ones
+        existing = load_existing_rows(conn, valid_rows, df_uploaded.columns)
+        accepted, rejected = validate_rows(df_uploaded, existing)
+        if not accepted.empty:
+            accepted.to_sql(KPI_TABLE, con=conn, if_exists='append', index=False)
+            refresh_summary(conn, accepted['year'].unique())
+            bump_data_version(conn)
+        quarantine_rows(conn, rejected, source_name)
+    publish_data_version(engine)
+    return accepted, rejected
+
+def publish_data_version(engine):
+    """
+    Release cache entries of older data versions after kpi_data changed.
+    Other workers switch over through their own data-version probe.
+    """
+    data_version = get_data_version(engine)
+    if data_version is not None:
+        switch_data_version(data_version)
+
+def switch_data_version(data_version):
+    """
+    Make data_version current in this process. The first time a process
+    sees a version, it also deletes older versions' entries from the
+    shared store, whatever changed the table (upload, archive, external load).
+    """
+    if not get_cache_manager().set_version(data_version):
+        return
+    try:
+        drop_stale_versions(create_shared_cache(), data_version)
+    except Exception as e:
+        # Entries are keyed by version, so a failed cleanup only wastes space
+        st.warning(f"Shared cache could not be updated: {e}")
+
+def render_cache_status():
+    """Admin view of the process-wide cache: usage against budget, hit rate, evictions"""
+    manager = get_cache_manager()
+    st.markdown("## 🧠 Cache Status")
+    stats = manager.stats()
+    total = stats.loc["total"]
+
+    cols = st.columns(4)
+    cols[0].metric("Entries", f"{int(total['entries'])}")
+    cols[1].metric("Memory", f"{total['bytes'] / 2**20:,.1f} MB",
+                   f"of {manager.budget_bytes / 2**20:,.0f} MB budget", delta_color="off")
+    cols[2].metric("Hit Rate", "n/a" if pd.isna(total["hit_rate"]) else f"{total['hit_rate']:.1%}")
+    cols[3].metric("Evictions", f"{int(total['evictions'])}")
+
+    st.markdown(f"### By Category ({manager.policy.upper()} eviction, base dataset kept longest)")
+    st.dataframe(stats)
+    with st.expander("📋 Cached Entries", expanded=False):
+        st.dataframe(manager.entries())
+
+    if st.button("Clear Cache", key="clear_cache"):
+        manager.clear()
+        st.rerun()
 
 # ==============================================
 # MAIN DASHBOARD FUNCTION - CALL THIS FROM LOGIN PAGE
@@ -650,14 +939,40 @@ def sci_kpi_dashboard():
         </div>
         """, unsafe_allow_html=True)
         
-        page = st.radio("Choose Action", ["📤 Upload CSV", "📊 KPI Dashboard"])
+        pages = ["📤 Upload CSV", "📊 KPI Dashboard"]
+        if st.session_state.get("email") in ADMIN_EMAILS:
+            pages.append("🧠 Cache Status")
+        page = st.radio("Choose Action", pages)
+
+        # Recent fiscal years by default; older years only on request
+        min_year = window_start_year(YEAR_WINDOW)
+        if min_year is not None and page == "📊 KPI Dashboard":
+            if st.checkbox("Include all fiscal years", value=False, key="full_history"):
+                min_year = None
+            else:
+                st.caption(f"Showing FY {min_year} onwards")
     
     if page == "📤 Upload CSV":
         handle_csv_upload(engine)
         return
+    if page == "🧠 Cache Status":
+        render_cache_status()
+        return
     
     # Main dashboard - Load data
-    df_cleaned = load_and_clean_data(engine)
+    data_version = get_data_version(engine)
+    if data_version is None:
+        st.error("Error loading data: the KPI table could not be reached.")
+        return
+    st.session_state["data_version"] = data_version
+    st.session_state["base_key"] = (data_version, min_year)
+    switch_data_version(data_version)
+    try:
+        df_base = load_monthly_base(engine, data_version, min_year)
+        catalog = load_dimension_catalog(engine, data_version, min_year)
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
+        return
     
     # Report type selection
     st.markdown("### 📁 Select Report Type to Continue")
@@ -680,4 +995,71 @@ def sci_kpi_dashboard():
     }
     
     if report_type in analysis_functions:
-        analysis_functions[report_type](df_cleaned)
\ No newline at end of file
+        analysis_functions[report_type](df_base, catalog)
+
+# ==============================================
+# HEADLESS REPORTS - python -m sci_dashboard report ...
+# ==============================================
+
+def run_report(view, from_year, to_year, fmt, output_dir):
+    """Build and write a KPI report without a browser"""
+    engine = create_db_engine()
+    data_version = get_data_version(engine)
+    if data_version is None:
+        raise RuntimeError("KPI table could not be reached")
+    base = load_monthly_base(engine, data_version, from_year)
+    if base.empty:
+        raise RuntimeError("No KPI data available to report on")
+
+    views = VIEWS if view == "all" else [view]
+    report = build_report(base, (from_year, to_year), views)
+    return write_report(report, output_dir, fmt, (from_year, to_year))
+
+def main(argv=None):
+    """Command-line entry point for batch report generation"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m sci_dashboard", description="SCI KPI Dashboard tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Generate KPI report files")
+    report_parser.add_argument("--view", choices=["all"] + VIEWS, default="all",
+                               help="Analysis view to export (default: all views in one pass)")
+    report_parser.add_argument("--from", dest="from_year", type=int, required=True, help="First year")
+    report_parser.add_argument("--to", dest="to_year", type=int, required=True, help="Last year")
+    report_parser.add_argument("--format", dest="fmt", choices=REPORT_FORMATS, default="csv")
+    report_parser.add_argument("--output", default="reports", help="Output directory (default: reports)")
+
+    subparsers.add_parser("partition", help="Partition kpi_data by fiscal year (MySQL/MariaDB)")
+
+    archive_parser = subparsers.add_parser("archive", help="Move old fiscal years to compressed Parquet")
+    archive_parser.add_argument("--before", type=int, required=True,
+                                help="Archive every fiscal year older than this one")
+    archive_parser.add_argument("--output", default="archive", help="Archive directory (default: archive)")
+
+    subparsers.add_parser("rebuild-summary", help="Recompute kpi_monthly_summary from kpi_data")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild-summary":
+        engine = create_db_engine()
+        ensure_schema(engine)
+        with engine.begin() as conn:
+            rebuild_summary(conn)
+            bump_data_version(conn)
+        publish_data_version(engine)
+    elif args.command == "partition":
+        partition_kpi_table(create_db_engine())
+    elif args.command == "archive":
+        engine = create_db_engine()
+        for year, rows, path in archive_years(engine, args.before, args.output):
+            print(f"FY {year}: {rows} rows -> {path}")
+        publish_data_version(engine)
+    else:
+        if args.from_year > args.to_year:
+            parser.error("--from must not be after --to")
+        for path in run_report(args.view, args.from_year, args.to_year, args.fmt, args.output):
+            print(path)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,208 @@
+# shared_cache.py
+"""
+SCI KPI Shared Cache Module
+Pluggable cache for the loaded KPI frame and its aggregates that every
+Streamlit worker process can read, so several workers behind a load
+balancer share one copy per data version instead of each reloading it.
+
+Backends (chosen with SHARED_CACHE_BACKEND):
+    memory  - in-process only; frames are left to the cache manager (single-worker default)
+    file    - Arrow IPC files in SHARED_CACHE_DIR (default /dev/shm/sci_dashboard),
+              memory-mapped on read so workers share the OS page cache
+    redis   - any Redis-compatible server at SHARED_CACHE_URL (needs `redis`)
+
+Entries are keyed by data version. Each worker finds the current version
+with its own database probe (get_data_version) and only ever reads the
+entries of that version; when a worker first sees a new version it
+removes the entries of older versions with drop_stale_versions().
+"""
+
+import logging
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# ==============================================
+# SERIALISATION
+# ==============================================
+
+def frame_to_bytes(df):
+    """Serialise a frame as an Arrow IPC file"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def frame_from_buffer(buffer):
+    """
+    Rebuild a frame from Arrow IPC bytes or a memory-mapped file. Text
+    columns stay Arrow-backed, so with a memory map they reference the
+    shared pages instead of being copied into each worker.
+    """
+    return pa.ipc.open_file(buffer).read_all().to_pandas(types_mapper=_arrow_string_dtype)
+
+def _arrow_string_dtype(pa_type):
+    if pa.types.is_string(pa_type) or pa.types.is_large_string(pa_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+def version_tag(version):
+    """Stable string form of a data version used inside cache keys"""
+    return "-".join(str(part) for part in version)
+
+def frame_key(name, version):
+    """Cache key of a named frame at a data version"""
+    return f"{name}@{version_tag(version)}"
+
+# ==============================================
+# BACKENDS
+# ==============================================
+
+class MemoryCacheBackend:
+    """In-process backend; also serves as the stand-in for tests and local runs"""
+
+    def __init__(self):
+        self._store = {}
+
+    def get(self, key):
+        return self._store.get(key)
+
+    def set(self, key, value):
+        self._store[key] = value
+
+    def keys(self):
+        return list(self._store)
+
+    def delete(self, key):
+        self._store.pop(key, None)
+
+    def get_frame(self, key):
+        # Nothing to share across processes: live frames are held by the
+        # dashboard's cache manager, where they count against its budget
+        return None
+
+    def set_frame(self, key, df):
+        pass
+
+
+class FileCacheBackend:
+    """Arrow IPC files in a directory shared by all workers on the host"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace("/", "_"))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+
+    def keys(self):
+        return [name for name in os.listdir(self.directory) if not name.startswith(".tmp-")]
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get_frame(self, key):
+        try:
+            return frame_from_buffer(pa.memory_map(self._path(key), "r"))
+        except FileNotFoundError:
+            return None
+
+    def set_frame(self, key, df):
+        self.set(key, frame_to_bytes(df))
+
+
+class RedisCacheBackend:
+    """Redis-compatible server shared by workers across hosts"""
+
+    def __init__(self, url, prefix="sci_dashboard:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("SHARED_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value)
+
+    def keys(self):
+        return [k.decode()[len(self.prefix):] for k in self.client.scan_iter(match=self.prefix + "*")]
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def get_frame(self, key):
+        data = self.get(key)
+        return None if data is None else frame_from_buffer(pa.py_buffer(data))
+
+    def set_frame(self, key, df):
+        self.set(key, frame_to_bytes(df))
+
+
+def create_backend(kind=None):
+    """Build the backend selected by SHARED_CACHE_BACKEND (default: memory)"""
+    kind = kind or os.getenv("SHARED_CACHE_BACKEND", "memory")
+    if kind == "memory":
+        return MemoryCacheBackend()
+    if kind == "file":
+        return FileCacheBackend(os.getenv("SHARED_CACHE_DIR", "/dev/shm/sci_dashboard"))
+    if kind == "redis":
+        return RedisCacheBackend(os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown SHARED_CACHE_BACKEND: {kind}")
+
+# ==============================================
+# CACHE OPERATIONS
+# ==============================================
+
+def cached_frame(backend, name, version, build):
+    """
+    Return the frame stored under (name, version), building and publishing
+    it with build() on a miss. Backend failures fall back to build().
+    """
+    key = frame_key(name, version)
+    try:
+        df = backend.get_frame(key)
+    except Exception as e:
+        logger.warning(f"Shared cache read failed for {key}: {e}")
+        return build()
+    if df is not None:
+        return df
+
+    df = build()
+    if not df.empty:
+        try:
+            backend.set_frame(key, df)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+    return df
+
+def drop_stale_versions(backend, version):
+    """Delete entries stored for any data version other than version"""
+    tag = version_tag(version)
+    for key in backend.keys():
+        if not key.endswith(f"@{tag}"):
+            backend.delete(key)
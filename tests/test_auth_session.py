@@ -0,0 +1,222 @@
+# test_auth_session.py
+"""
+Offline token verification and session refresh, with the Google key
+endpoint replaced by a locally generated RS256 key and certificate.
+"""
+
+import datetime
+import threading
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+import auth_session
+from auth_session import PublicKeyCache, SessionStore, TokenError, TokenExpired, verify_id_token
+
+PROJECT_ID = "sci-test-project"
+KEY_ID = "test-key"
+EMAIL = "analyst@example.com"
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    """Private key (PEM) plus the certificate the mocked endpoint serves"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken-test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return {
+        "private_pem": private_pem,
+        "cert": cert.public_bytes(serialization.Encoding.PEM).decode(),
+    }
+
+
+@pytest.fixture
+def key_endpoint(signing_key):
+    """Stand-in for fetch_google_certs that counts its calls"""
+    calls = []
+
+    def fetch():
+        calls.append(time.time())
+        return {KEY_ID: signing_key["cert"]}, 3600
+
+    fetch.calls = calls
+    return fetch
+
+
+def make_token(signing_key, expires_in=3600, audience=PROJECT_ID, key_id=KEY_ID):
+    now = int(time.time())
+    signer = crypt.RSASigner.from_string(signing_key["private_pem"], key_id=key_id)
+    payload = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": audience,
+        "sub": "uid-1",
+        "email": EMAIL,
+        "iat": now,
+        "exp": now + expires_in,
+    }
+    return jwt.encode(signer, payload).decode()
+
+# ==============================================
+# TOKEN VERIFICATION
+# ==============================================
+
+def test_valid_token_verifies_offline_after_first_fetch(signing_key, key_endpoint):
+    keys = PublicKeyCache(key_endpoint)
+    for _ in range(3):
+        claims = verify_id_token(make_token(signing_key), keys, PROJECT_ID)
+    assert claims["email"] == EMAIL
+    assert len(key_endpoint.calls) == 1
+
+
+def test_expired_token_raises_token_expired(signing_key, key_endpoint):
+    with pytest.raises(TokenExpired):
+        verify_id_token(make_token(signing_key, expires_in=-10), PublicKeyCache(key_endpoint), PROJECT_ID)
+
+
+def test_wrong_audience_is_rejected(signing_key, key_endpoint):
+    token = make_token(signing_key, audience="another-project")
+    with pytest.raises(TokenError) as excinfo:
+        verify_id_token(token, PublicKeyCache(key_endpoint), PROJECT_ID)
+    assert not isinstance(excinfo.value, TokenExpired)
+
+
+def test_unknown_key_id_is_rejected_and_refetch_is_rate_limited(signing_key, key_endpoint):
+    keys = PublicKeyCache(key_endpoint)
+    verify_id_token(make_token(signing_key), keys, PROJECT_ID)
+    token = make_token(signing_key, key_id="rotated-away")
+    for _ in range(3):
+        with pytest.raises(TokenError, match="unknown key"):
+            verify_id_token(token, keys, PROJECT_ID)
+    # One refetch for the unknown kid right after the first fetch is skipped
+    assert len(key_endpoint.calls) == 1
+
+
+def test_keys_are_refetched_after_max_age(signing_key, key_endpoint):
+    now = [1000.0]
+    keys = PublicKeyCache(key_endpoint, clock=lambda: now[0])
+    keys.certs()
+    now[0] += 3599
+    keys.certs()
+    assert len(key_endpoint.calls) == 1
+    now[0] += 2
+    keys.certs()
+    assert len(key_endpoint.calls) == 2
+
+def test_cached_keys_are_served_while_the_endpoint_is_down(signing_key, key_endpoint):
+    now = [1000.0]
+    calls = []
+
+    def flaky_fetch():
+        calls.append(now[0])
+        if len(calls) > 1:
+            raise ConnectionError("certificate endpoint unreachable")
+        return key_endpoint()
+
+    keys = PublicKeyCache(flaky_fetch, clock=lambda: now[0])
+    token = make_token(signing_key)
+    verify_id_token(token, keys, PROJECT_ID)
+    now[0] += 3601
+    for _ in range(3):
+        assert verify_id_token(token, keys, PROJECT_ID)["email"] == EMAIL
+    # Retried only after MIN_KEY_REFETCH
+    assert len(calls) == 2
+    now[0] += auth_session.MIN_KEY_REFETCH
+    verify_id_token(token, keys, PROJECT_ID)
+    assert len(calls) == 3
+
+
+def test_first_key_fetch_failure_is_raised():
+    def down():
+        raise ConnectionError("certificate endpoint unreachable")
+
+    with pytest.raises(ConnectionError):
+        PublicKeyCache(down).certs()
+
+# ==============================================
+# SESSIONS
+# ==============================================
+
+def make_store(signing_key, key_endpoint, approved=True):
+    refreshed = threading.Event()
+    state = {"approved": approved, "refreshes": 0}
+
+    def refresh(refresh_token):
+        state["refreshes"] += 1
+        refreshed.set()
+        return {"idToken": make_token(signing_key), "refreshToken": f"refresh-{state['refreshes']}"}
+
+    store = SessionStore(PublicKeyCache(key_endpoint), PROJECT_ID, refresh, lambda email: state["approved"])
+    return store, state, refreshed
+
+
+def test_session_resumes_locally_and_only_for_its_client(signing_key, key_endpoint):
+    store, state, _ = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key), "refreshToken": "r0"}, True, client="browser-a")
+    assert store.resume(sid, "browser-a") == EMAIL
+    assert store.resume(sid, "browser-b") is None
+    assert store.resume("unknown", "browser-a") is None
+    assert state["refreshes"] == 0
+
+
+def test_client_mismatch_leaves_session_in_place(signing_key, key_endpoint):
+    store, _, _ = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key), "refreshToken": "r0"}, True, client="browser-a")
+    for _ in range(3):
+        assert store.resume(sid, "browser-b") is None
+    assert sid in store._sessions
+    assert store.resume(sid, "browser-a") == EMAIL
+
+
+def test_token_near_expiry_is_refreshed_in_background(signing_key, key_endpoint):
+    store, state, refreshed = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key, expires_in=60), "refreshToken": "r0"}, True)
+    # Served immediately from the still-valid token
+    assert store.resume(sid) == EMAIL
+    assert refreshed.wait(5)
+    store._executor.shutdown(wait=True)
+    assert store._sessions[sid]["refresh_token"] == "refresh-1"
+    assert store._sessions[sid]["expires_at"] > time.time() + auth_session.REFRESH_MARGIN
+
+
+def test_expired_token_is_refreshed_before_serving(signing_key, key_endpoint):
+    store, state, _ = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key), "refreshToken": "r0"}, True)
+    store._sessions[sid]["id_token"] = make_token(signing_key, expires_in=-10)
+    assert store.resume(sid) == EMAIL
+    assert state["refreshes"] == 1
+
+
+def test_withdrawn_approval_ends_session_on_refresh(signing_key, key_endpoint):
+    store, state, _ = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key), "refreshToken": "r0"}, True)
+    state["approved"] = False
+    store._sessions[sid]["approved_at"] = 0
+    assert store.resume(sid) == EMAIL
+    store._executor.shutdown(wait=True)
+    assert store.resume(sid) is None
+
+
+def test_session_past_max_age_is_dropped(signing_key, key_endpoint):
+    store, _, _ = make_store(signing_key, key_endpoint)
+    sid = store.create({"idToken": make_token(signing_key), "refreshToken": "r0"}, True)
+    store._sessions[sid]["created"] -= auth_session.SESSION_MAX_AGE + 1
+    assert store.resume(sid) is None
+    assert sid not in store._sessions